@@ -0,0 +1,221 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+# Staged files live here, inside the output directory so that renaming them into place never
+# crosses a file system. workspace.IGNORED_DIRS keeps it out of snapshots.
+STAGING_DIR = ".staging"
+MANIFEST = "manifest.json"
+
+# One lock per output directory, so recover() never mistakes another thread's transaction
+# that is still being staged for an interrupted one.
+_directory_locks = {}
+_directory_locks_lock = threading.Lock()
+# Staging directories of transactions in this process that have staged files but not committed
+# yet (see FileTransaction.stage). recover() leaves them alone.
+_active_staging = set()
+
+def directory_lock(output_directory):
+    with _directory_locks_lock:
+        return _directory_locks.setdefault(os.path.abspath(output_directory), threading.Lock())
+
+def fsync_directory(path):
+    """Flush a directory entry (e.g. after renames) to disk, where the platform supports it."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def read_existing(file_path):
+    """Return the current content of a file, or None if it doesn't exist or isn't UTF-8 text."""
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+def apply_staged(output_directory, staging_path, filenames):
+    """
+    Rename staged files 0, 1, 2, ... into place as filenames; already moved files are skipped.
+    A file that replaces an existing one keeps that file's permission bits.
+    """
+    directories = set()
+    for index, filename in enumerate(filenames):
+        staged = os.path.join(staging_path, str(index))
+        if not os.path.exists(staged):
+            continue
+        target = os.path.join(output_directory, filename)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.chmod(staged, stat.S_IMODE(os.stat(target).st_mode))
+        except FileNotFoundError:
+            pass  # A new file keeps the default mode.
+        os.replace(staged, target)
+        directories.add(os.path.dirname(target))
+    for directory in directories:
+        fsync_directory(directory)
+
+def read_manifest(staging_path):
+    """Return the filenames listed in a staging directory's manifest, or None if it has no valid one."""
+    try:
+        with open(os.path.join(staging_path, MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)["files"]
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError):
+        # Manifests are renamed into place complete, so this one was never committed.
+        return None
+
+def write_manifest(staging_path, filenames):
+    """Write the manifest (the commit point) to a temporary file and rename it into place."""
+    path = os.path.join(staging_path, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"files": filenames}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    fsync_directory(staging_path)
+
+def recover(output_directory):
+    """
+    Finish or discard transactions interrupted by a crash. A transaction whose manifest was
+    written had staged every file, so its remaining renames are completed; one without a
+    (complete) manifest never started renaming and is thrown away.
+    Returns the number of transactions completed.
+    """
+    staging_root = os.path.join(output_directory, STAGING_DIR)
+    if not os.path.isdir(staging_root):
+        return 0
+    completed = 0
+    for name in sorted(os.listdir(staging_root)):
+        staging_path = os.path.join(staging_root, name)
+        with _directory_locks_lock:
+            if staging_path in _active_staging:
+                continue
+        filenames = read_manifest(staging_path)
+        if filenames is not None:
+            apply_staged(output_directory, staging_path, filenames)
+            completed += 1
+        shutil.rmtree(staging_path, ignore_errors=True)
+    remove_staging_root(output_directory)
+    return completed
+
+def remove_staging_root(output_directory):
+    try:
+        os.rmdir(os.path.join(output_directory, STAGING_DIR))
+    except OSError:
+        pass  # Missing, or another transaction's files are still in it.
+
+class FileTransaction:
+    """
+    Writes a batch of files into a directory so that it never ends up half-written.
+
+    Files are given with add(), which keeps them in memory until commit(), or with stage(),
+    which writes them to the staging directory right away (e.g. while a model is still
+    streaming the rest of the batch). Either way, files identical to the version on disk are
+    dropped, and the staged files are fsynced. commit() then writes a manifest (the commit
+    point, itself renamed into place so it is never seen half-written) and renames each staged
+    file over its target with os.replace. If the process dies before the manifest exists, no
+    file was touched. If it dies after, recover() (run at the start of every commit) completes
+    the renames. So once recovered, the directory holds either the old or the new version of
+    the whole batch, and no file is ever partially written.
+    """
+
+    def __init__(self, output_directory):
+        self.output_directory = output_directory
+        self.files = {}
+        self.staging_path = None
+        self.staged = []  # filename of each staged file 0, 1, 2, ... (the manifest)
+        self.live = {}  # filename -> index of its latest staged version
+
+    def add(self, filename, content):
+        """Add a file (path relative to the output directory) to be written on commit()."""
+        self.files[filename] = content
+
+    def stage(self, filename, content):
+        """
+        Write a file to the staging directory now instead of keeping it in memory until
+        commit(). Returns False (and stages nothing) if the file on disk is already up to date.
+        """
+        self.files.pop(filename, None)
+        previous = self.live.pop(filename, None)
+        if previous is not None:
+            os.remove(os.path.join(self.staging_path, str(previous)))
+        if read_existing(os.path.join(self.output_directory, filename)) == content:
+            return False
+        if self.staging_path is None:
+            with directory_lock(self.output_directory):
+                staging_root = os.path.join(self.output_directory, STAGING_DIR)
+                os.makedirs(staging_root, exist_ok=True)
+                self.staging_path = tempfile.mkdtemp(dir=staging_root)
+                with _directory_locks_lock:
+                    _active_staging.add(self.staging_path)
+        index = len(self.staged)
+        with open(os.path.join(self.staging_path, str(index)), "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        self.staged.append(filename)
+        self.live[filename] = index
+        return True
+
+    def changed_files(self):
+        """Return the added and staged filenames whose content differs from the file on disk."""
+        return list(self.live) + [
+            filename for filename, content in self.files.items()
+            if read_existing(os.path.join(self.output_directory, filename)) != content
+        ]
+
+    def commit(self):
+        """Write every changed file. Returns the list of filenames written (unchanged ones are skipped)."""
+        try:
+            for filename, content in list(self.files.items()):
+                self.stage(filename, content)
+            with directory_lock(self.output_directory):
+                return self._commit()
+        finally:
+            self.discard()
+
+    def discard(self):
+        """Throw away the files that were added or staged but not committed."""
+        if self.staging_path is not None:
+            with _directory_locks_lock:
+                uncommitted = self.staging_path in _active_staging
+                _active_staging.discard(self.staging_path)
+            if uncommitted:
+                shutil.rmtree(self.staging_path, ignore_errors=True)
+                with directory_lock(self.output_directory):
+                    remove_staging_root(self.output_directory)
+        self.files = {}
+        self.staging_path = None
+        self.staged = []
+        self.live = {}
+
+    def _commit(self):
+        recover(self.output_directory)
+        if not self.live:
+            return []
+        write_manifest(self.staging_path, self.staged)
+        # Committed: if a rename fails from here on, the next recover() completes the batch.
+        with _directory_locks_lock:
+            _active_staging.discard(self.staging_path)
+        apply_staged(self.output_directory, self.staging_path, self.staged)
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+        remove_staging_root(self.output_directory)
+        return sorted(self.live, key=self.live.get)
+
+def write_files_atomically(file_dict, output_directory):
+    """Write a dictionary of filenames to contents as one FileTransaction. Returns the filenames written."""
+    transaction = FileTransaction(output_directory)
+    for filename, content in file_dict.items():
+        transaction.add(filename, content)
+    return transaction.commit()
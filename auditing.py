@@ -0,0 +1,99 @@
+import contextvars
+import io
+import tokenize
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+UNCHANGED = "unchanged"
+WHITESPACE_ONLY = "whitespace_only"
+CHANGED = "changed"
+
+def string_literal_lines(source):
+    """
+    Return the numbers (starting at 1) of the lines of Python source whose line break is inside
+    a string literal: every line of a multi-line string such as a triple-quoted docstring but
+    the last. Trailing whitespace and blank lines there are part of the string.
+    Returns None if the source doesn't tokenize.
+    """
+    fstring_start = getattr(tokenize, "FSTRING_START", None)  # Python 3.12+
+    fstring_end = getattr(tokenize, "FSTRING_END", None)
+    lines = set()
+    open_fstrings = []
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(source).readline):
+            if token.type == tokenize.STRING:
+                lines.update(range(token.start[0], token.end[0]))
+            elif fstring_start is not None and token.type == fstring_start:
+                open_fstrings.append(token.start[0])
+            elif fstring_end is not None and token.type == fstring_end and open_fstrings:
+                lines.update(range(open_fstrings.pop(), token.end[0]))
+    except (tokenize.TokenError, SyntaxError):
+        return None
+    return lines
+
+def normalize_whitespace(text, filename=None):
+    """
+    Normalize insignificant whitespace: line endings, trailing spaces on each line,
+    and blank lines. Indentation is kept because it is meaningful in Python.
+    In Python files, lines inside multi-line string literals are kept exactly as they are,
+    blank ones included; if the file doesn't tokenize, only trailing spaces are normalized.
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    protected = set()
+    if filename is not None and filename.endswith(".py"):
+        protected = string_literal_lines(text)
+        if protected is None:
+            return "\n".join(line.rstrip() for line in text.split("\n")).rstrip("\n")
+    normalized = []
+    for number, line in enumerate(text.split("\n"), start=1):
+        if number in protected:
+            normalized.append(line)
+        elif line.rstrip():
+            normalized.append(line.rstrip())
+    return "\n".join(normalized)
+
+def classify_change(original_content, new_content, filename=None):
+    """
+    Decide whether a file needs an audit.
+    Returns UNCHANGED if the contents are identical, WHITESPACE_ONLY if they differ only in
+    insignificant whitespace (see normalize_whitespace), and CHANGED otherwise.
+    Pass the filename so whitespace inside Python string literals counts as a change.
+    """
+    if original_content == new_content:
+        return UNCHANGED
+    if normalize_whitespace(original_content, filename) == normalize_whitespace(new_content, filename):
+        return WHITESPACE_ONLY
+    return CHANGED
+
+def run_audits(jobs, audit_fn, on_result, model=None, max_workers=4):
+    """
+    Audit many files at once.
+    jobs is a list of (filename, original_content, new_content) tuples. Each audit is
+    audit_fn(original_content, new_content) (plus model=model when a model is given).
+    audit_fn is called once per file: retries, if any, are its own job (e.g. through a
+    rate_limit.RequestScheduler).
+    on_result(filename, audited_content) is called in the calling thread as soon as each audit
+    completes, so results can be written right away.
+
+    Returns a dictionary mapping each file whose audit failed to its exception,
+    ordered by filename so the outcome does not depend on which worker finished first.
+    """
+    kwargs = {"model": model} if model is not None else {}
+    failures = {}
+    if not jobs:
+        return failures
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as pool:
+        futures = {
+            pool.submit(contextvars.copy_context().run, audit_fn, original, new, **kwargs): filename
+            for filename, original, new in jobs
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                audited_content = future.result()
+            except Exception as e:
+                failures[filename] = e
+                continue
+            on_result(filename, audited_content)
+
+    return dict(sorted(failures.items()))
@@ -0,0 +1,255 @@
+import hashlib
+import time
+
+from context_packing import render_file
+from parsing import parse_file_blocks
+from response_cache import CacheMissError, ResponseCache
+
+class ModelBackend:
+    """
+    Interface the orchestrator uses for every model call.
+    stage names the pipeline step making the call ("generate", "review", "aggregate",
+    "audit" or "gap_analysis"); backends may use it but don't have to.
+    Responses of backends with cacheable = False are kept out of the response cache.
+    """
+
+    cacheable = True
+
+    def complete(self, prompt, model, stage=None):
+        """Return the full response text for a single-message prompt."""
+        raise NotImplementedError
+
+    def stream(self, prompt, model, stage=None):
+        """Yield the response text in chunks. By default the whole response is one chunk."""
+        yield self.complete(prompt, model, stage)
+
+class OpenAIBackend(ModelBackend):
+    """
+    Calls the OpenAI chat completions API. base_url can point the client at any
+    compatible server, for example stub_server.py for offline runs.
+    The client's own retries are off by default (max_retries=0): failed calls are
+    retried by the orchestrator's rate_limit.RequestScheduler instead.
+    """
+
+    def __init__(self, api_key=None, base_url=None, timeout=600.0, max_retries=0):
+        # Imported here so the other backends work without the openai package installed.
+        import openai
+        self.client = openai.OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=max_retries)
+
+    def complete(self, prompt, model, stage=None):
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+        )
+        return response.choices[0].message.content
+
+    def stream(self, prompt, model, stage=None):
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True,
+        )
+        for event in stream:
+            if not event.choices:
+                continue
+            chunk = event.choices[0].delta.content
+            if chunk:
+                yield chunk
+
+def section_between(text, start_marker, end_marker=None):
+    """Return the text after start_marker and before end_marker (or the end), or "" if absent."""
+    start = text.find(start_marker)
+    if start < 0:
+        return ""
+    start += len(start_marker)
+    end = text.find(end_marker, start) if end_marker else -1
+    return text[start:end] if end >= 0 else text[start:]
+
+def infer_stage(prompt):
+    """Guess which pipeline stage wrote a prompt, for callers that don't pass one (e.g. stub_server.py)."""
+    if prompt.startswith("You are an expert code integrator"):
+        return "audit"
+    if prompt.startswith("You are to merge"):
+        return "aggregate"
+    if prompt.startswith("Review the following code"):
+        return "gap_analysis"
+    if "Return the corrected code in the following format" in prompt:
+        return "review"
+    return "generate"
+
+class StubBackend(ModelBackend):
+    """
+    Deterministic, offline stand-in for a model, for testing and benchmarking the orchestrator.
+
+    - generate: a synthetic project of num_files files of about file_lines lines each,
+      derived from a hash of the prompt, so the same prompt always gives the same project;
+    - review: the code it was given with one of two sets of edits (REVIEW_EDITS), chosen by a
+      hash of the reviewer's instructions. The two sets both change line 3 of app.py (a
+      conflict), change different lines of module_2.css (merged locally), and only the first
+      changes module_1.html and adds trailing whitespace to module_3.js;
+    - aggregate: the original code, or for a conflict-only prompt each original file with
+      RESOLVED_MARKER appended;
+    - audit: the revised file content, wrapped in a markdown code fence;
+    - gap_analysis: a fixed list of suggestions.
+
+    latency adds a fixed delay (in seconds) to every call, and chunk_size controls the
+    size of the chunks stream() yields.
+    """
+
+    cacheable = False
+    GAP_ANALYSIS = "- Add input validation to the task form.\n- Show a message when the task list is empty."
+    # filename -> {line index: new line} for each of the two kinds of reviewer; index -1 is the last line.
+    REVIEW_EDITS = [
+        {
+            "app.py": {3: "value_3 = 3  # checked by the first reviewer"},
+            "module_1.html": {1: "/* heading fixed by the first reviewer */"},
+            "module_2.css": {2: "/* colour fixed by the first reviewer */"},
+            "module_3.js": {5: None},  # None: add trailing whitespace to the line
+        },
+        {
+            "app.py": {3: "value_3 = 3  # checked by the second reviewer"},
+            "module_2.css": {-1: "/* margin fixed by the second reviewer */"},
+        },
+    ]
+    RESOLVED_MARKER = "resolved by the stub aggregator"
+
+    def __init__(self, num_files=5, file_lines=40, latency=0.0, chunk_size=64):
+        self.num_files = num_files
+        self.file_lines = file_lines
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.calls = 0
+
+    def complete(self, prompt, model, stage=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if stage is None:
+            stage = infer_stage(prompt)
+        if stage == "review":
+            return self.review(prompt)
+        if stage == "aggregate":
+            original = section_between(prompt, "Original Code:\n", "\n\nReviewer 1")
+            if original:
+                return original.strip()
+            # Conflict-only prompt: return each original file in full, marked as resolved.
+            files, _ = parse_file_blocks(prompt, strip_fences=False)
+            return "".join(
+                render_file(path, content + "\n" + self.comment(path, self.RESOLVED_MARKER))
+                for path, content in files.items()
+            )
+        if stage == "audit":
+            revised = section_between(
+                prompt, "Revised file content:\n----------------------\n", "\n----------------------"
+            )
+            return f"```\n{revised}\n```"
+        if stage == "gap_analysis":
+            return self.GAP_ANALYSIS
+        return self.synthetic_project(prompt)
+
+    def review(self, prompt):
+        code = section_between(prompt, "Here is the code:\n", "\n\nEnsure the final output").strip()
+        instructions = prompt[:prompt.find("\n\nReturn the corrected code")]
+        edits = self.REVIEW_EDITS[int(hashlib.sha256(instructions.encode("utf-8")).hexdigest(), 16) % 2]
+        files, _ = parse_file_blocks(code, strip_fences=False)
+        for path, line_edits in edits.items():
+            if path not in files:
+                continue
+            lines = files[path].split("\n")
+            for index, line in line_edits.items():
+                if -len(lines) <= index < len(lines):
+                    lines[index] = lines[index] + "   " if line is None else line
+            files[path] = "\n".join(lines)
+        return "".join(render_file(path, content) for path, content in files.items()).strip()
+
+    @staticmethod
+    def comment(path, text):
+        return f"# {text}" if path.endswith(".py") else f"/* {text} */"
+
+    def stream(self, prompt, model, stage=None):
+        text = self.complete(prompt, model, stage)
+        for start in range(0, len(text), self.chunk_size):
+            yield text[start:start + self.chunk_size]
+
+    def synthetic_project(self, prompt):
+        seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        extensions = [".py", ".html", ".css", ".js"]
+        parts = []
+        for index in range(self.num_files):
+            extension = extensions[index % len(extensions)]
+            name = "app.py" if index == 0 else f"module_{index}{extension}"
+            if extension == ".py":
+                body = "\n".join(f"value_{i} = {i} * {index}  # {seed}" for i in range(self.file_lines))
+            else:
+                body = "\n".join(f"/* {seed} line {i} of file {index} */" for i in range(self.file_lines))
+            parts.append(render_file(name, body))
+        return "".join(parts)
+
+class RecordReplayBackend(ModelBackend):
+    """
+    Records every response of an inner backend to a SQLite file (mode="record"),
+    or answers only from such a recording without any inner backend (mode="replay").
+    A prompt that was never recorded raises CacheMissError in replay mode.
+    """
+
+    cacheable = False
+
+    def __init__(self, path, mode="replay", inner=None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown record/replay mode: {mode}")
+        if mode == "record" and inner is None:
+            raise ValueError("Record mode needs an inner backend to record from.")
+        self.mode = mode
+        self.inner = inner
+        self.store = ResponseCache(path, read_only=(mode == "replay"))
+
+    def complete(self, prompt, model, stage=None):
+        if self.mode == "replay":
+            recorded = self.store.get(model, prompt)
+            if recorded is None:
+                raise CacheMissError(f"No recorded {stage or 'model'} response for this prompt.")
+            return recorded
+        response = self.inner.complete(prompt, model, stage)
+        self.store.put(model, prompt, response)
+        return response
+
+    def stream(self, prompt, model, stage=None):
+        if self.mode == "replay":
+            yield self.complete(prompt, model, stage)
+            return
+        chunks = []
+        for chunk in self.inner.stream(prompt, model, stage):
+            chunks.append(chunk)
+            yield chunk
+        self.store.put(model, prompt, "".join(chunks))
+
+def make_backend(backend_config, api_key=None):
+    """
+    Build a backend from the "backend" section of config.json, e.g.
+    {"type": "openai"}, {"type": "openai", "base_url": "http://127.0.0.1:8765/v1"},
+    {"type": "stub", "num_files": 20}, {"type": "record", "path": "recording.db"} or
+    {"type": "replay", "path": "recording.db"}. Record mode records from an OpenAI backend
+    unless "inner" names another backend section.
+    """
+    backend_type = backend_config.get("type", "openai")
+    if backend_type == "openai":
+        return OpenAIBackend(
+            api_key=api_key,
+            base_url=backend_config.get("base_url"),
+            timeout=backend_config.get("timeout", 600.0),
+            max_retries=backend_config.get("max_retries", 0),
+        )
+    if backend_type == "stub":
+        return StubBackend(
+            num_files=backend_config.get("num_files", 5),
+            file_lines=backend_config.get("file_lines", 40),
+            latency=backend_config.get("latency", 0.0),
+            chunk_size=backend_config.get("chunk_size", 64),
+        )
+    if backend_type in ("record", "replay"):
+        path = backend_config.get("path", "recording.db")
+        if backend_type == "replay":
+            return RecordReplayBackend(path, mode="replay")
+        inner = make_backend(backend_config.get("inner", {"type": "openai"}), api_key=api_key)
+        return RecordReplayBackend(path, mode="record", inner=inner)
+    raise ValueError(f"Unknown model backend type: {backend_type}")
@@ -0,0 +1,175 @@
+"""
+Run many generation pipelines at once.
+
+Usage: python batch.py manifest.json [--resume] [--max-jobs N] [--max-model-calls N]
+                                     [--report batch_report.json] [--backend stub]
+
+The manifest is a JSON file listing the jobs, for example:
+
+    {
+        "max_jobs": 3,
+        "max_model_calls": 8,
+        "jobs": [
+            {"prompt_file": "BasePrompt.txt", "output_dir": "todo_app"},
+            {"prompt_file": "WebsitePrompt.txt", "output_dir": "website_files", "max_iterations": 3},
+            {"name": "banana", "prompt_file": "BananaPrompt.txt", "output_dir": "Banana_website_files"}
+        ]
+    }
+
+Each job is an openapi.Pipeline with its own feedback file (feedback_<name>.txt) and
+checkpoint directory (json_outputs/<name>) unless the manifest gives "feedback_file" or
+"checkpoint_dir". The name defaults to the name of the output directory. At most max_jobs
+pipelines run at the same time, and all of them share openapi.SCHEDULER, so there are never
+more than max_model_calls model calls in flight in total. When all jobs are done, a
+throughput report is printed and written to a JSON file.
+"""
+import argparse
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openapi
+from backends import make_backend
+from metrics import CURRENT_JOB
+
+def load_manifest(path):
+    """Return (jobs, settings) from a manifest file; each job gets all of its settings filled in."""
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    jobs = []
+    names = set()
+    for entry in manifest.get("jobs", []):
+        if "prompt_file" not in entry or "output_dir" not in entry:
+            raise ValueError(f"Every job needs a prompt_file and an output_dir: {entry}")
+        name = entry.get("name") or os.path.basename(os.path.normpath(entry["output_dir"]))
+        if name in names:
+            raise ValueError(f"Two jobs are named {name}; give them distinct names.")
+        names.add(name)
+        jobs.append({
+            "name": name,
+            "prompt_file": entry["prompt_file"],
+            "output_dir": entry["output_dir"],
+            "feedback_file": entry.get("feedback_file", f"feedback_{name}.txt"),
+            "checkpoint_dir": entry.get("checkpoint_dir", os.path.join(openapi.CHECKPOINT_DIR, name)),
+            "max_iterations": entry.get("max_iterations", openapi.MAX_ITERATIONS),
+        })
+    settings = {key: manifest[key] for key in ("max_jobs", "max_model_calls") if key in manifest}
+    return jobs, settings
+
+def run_job(job, resume=False):
+    """Run one job's pipeline and return its result for the report. Exceptions are reported, not raised."""
+    CURRENT_JOB.set(job["name"])
+    pipeline = openapi.Pipeline(
+        output_dir=job["output_dir"],
+        prompt_file=job["prompt_file"],
+        feedback_path=job["feedback_file"],
+        checkpoint_dir=job["checkpoint_dir"],
+        max_iterations=job["max_iterations"],
+    )
+    start = time.perf_counter()
+    result = {"name": job["name"], "output_dir": job["output_dir"]}
+    try:
+        result["iterations"] = pipeline.run(resume=resume)
+        result["status"] = "ok"
+    except Exception as e:
+        openapi.safe_print(f"Job failed: {type(e).__name__}: {e}")
+        result["status"] = "failed"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    totals = openapi.METRICS.summary(job["name"]).values()
+    for column in ("calls", "retries", "prompt_tokens", "completion_tokens", "cost"):
+        result[column] = sum(row[column] for row in totals)
+    result["cost"] = round(result["cost"], 6)
+    return result
+
+def run_batch(jobs, max_jobs=3, max_model_calls=8, resume=False):
+    """
+    Run the jobs with at most max_jobs pipelines and max_model_calls model calls at a time.
+    Returns the throughput report: one result per job (in manifest order) and the totals.
+    """
+    openapi.SCHEDULER.set_max_concurrent(max_model_calls)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_jobs, len(jobs)))) as pool:
+        # Each job gets its own context, so its CURRENT_JOB doesn't leak into other jobs.
+        futures = [pool.submit(contextvars.copy_context().run, run_job, job, resume) for job in jobs]
+        results = [future.result() for future in futures]
+    wall_seconds = time.perf_counter() - start
+
+    calls = sum(result["calls"] for result in results)
+    tokens = sum(result["prompt_tokens"] + result["completion_tokens"] for result in results)
+    job_seconds = sum(result["seconds"] for result in results)
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "max_jobs": max_jobs,
+        "max_model_calls": max_model_calls,
+        "jobs": results,
+        "totals": {
+            "jobs": len(results),
+            "failed": sum(result["status"] != "ok" for result in results),
+            "wall_seconds": round(wall_seconds, 3),
+            "job_seconds": round(job_seconds, 3),
+            # How much running the jobs side by side saved over running them one by one.
+            "speedup": round(job_seconds / wall_seconds, 2) if wall_seconds else None,
+            "jobs_per_hour": round(len(results) * 3600 / wall_seconds, 2) if wall_seconds else None,
+            "calls": calls,
+            "calls_per_minute": round(calls * 60 / wall_seconds, 2) if wall_seconds else None,
+            "tokens": tokens,
+            "tokens_per_second": round(tokens / wall_seconds, 1) if wall_seconds else None,
+            "retries": sum(result["retries"] for result in results),
+            "cost": round(sum(result["cost"] for result in results), 6),
+        },
+    }
+
+def format_batch_report(report):
+    """Return a printable table of a run_batch() report."""
+    lines = [f"  {'job':<24} {'status':<8} {'iters':>6} {'took (s)':>10} {'calls':>7} {'retries':>8} {'tokens':>9} {'cost ($)':>9}"]
+    for result in report["jobs"]:
+        lines.append(
+            f"  {result['name']:<24} {result['status']:<8} {result.get('iterations', '-'):>6} "
+            f"{result['seconds']:>10.2f} {result['calls']:>7} {result['retries']:>8} "
+            f"{result['prompt_tokens'] + result['completion_tokens']:>9} {result['cost']:>9.4f}"
+        )
+    totals = report["totals"]
+    lines.append(
+        f"  {totals['jobs']} jobs ({totals['failed']} failed) in {totals['wall_seconds']:.2f} s "
+        f"({totals['speedup']}x faster than one by one): {totals['jobs_per_hour']} jobs/hour, "
+        f"{totals['calls_per_minute']} calls/minute, {totals['tokens_per_second']} tokens/second, "
+        f"{totals['retries']} retries, ${totals['cost']:.4f}"
+    )
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate several applications concurrently.")
+    parser.add_argument("manifest", help="JSON file listing the jobs")
+    parser.add_argument("--resume", action="store_true", help="resume every job from its latest checkpoint")
+    parser.add_argument("--max-jobs", type=int, help="pipelines running at the same time (default 3)")
+    parser.add_argument("--max-model-calls", type=int, help="model calls in flight across all jobs (default 8)")
+    parser.add_argument("--report", default="batch_report.json", help="path of the JSON throughput report")
+    parser.add_argument("--backend", choices=["openai", "stub", "record", "replay"],
+                        help="model backend to use instead of the one in config.json")
+    openapi.add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+
+    jobs, settings = load_manifest(args.manifest)
+    openapi.configure_response_cache(args)
+    if args.backend:
+        openapi.set_backend(make_backend(
+            dict(openapi.config.get("backend", {}), type=args.backend), api_key=openapi.config.get("api_key")
+        ))
+    report = run_batch(
+        jobs,
+        max_jobs=args.max_jobs or settings.get("max_jobs", 3),
+        max_model_calls=args.max_model_calls or settings.get("max_model_calls", 8),
+        resume=args.resume,
+    )
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    openapi.safe_print("\nBatch report:")
+    openapi.safe_print(format_batch_report(report))
+    openapi.safe_print(f"Report written to {args.report}")
+    openapi.print_cache_stats()
+
+if __name__ == "__main__":
+    main()
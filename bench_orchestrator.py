@@ -0,0 +1,150 @@
+"""
+End-to-end benchmark of the orchestrator's local work (no network).
+
+Usage: python bench_orchestrator.py [--files 10 100 1000] [--sizes 1 10 50] [--output bench_results.json]
+
+For every combination of file count and total size (in MB), a synthetic project is built
+with testing.generate_synthetic_code and run through parse_files, write_files,
+assemble_files (cold and warm snapshot), audited_write_files (with the offline stub model
+from backends.py doing the audits) and remove_triple_backtick_lines. Each operation is
+timed, then run again under tracemalloc to record its peak memory. The results are written
+to a JSON report so runs of different versions can be compared.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(fn, with_memory):
+    """Run fn with its output silenced. Returns (seconds, peak_mb or None, result)."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        if not with_memory:
+            start = time.perf_counter()
+            result = fn()
+            return time.perf_counter() - start, None, result
+        tracemalloc.start()
+        try:
+            result = fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return None, peak / (1024 * 1024), result
+
+def bench_project(num_files, size_mb, workdir, openapi, testing, parsing):
+    """Benchmark every operation on one synthetic project. Returns a list of result rows."""
+    text = testing.generate_synthetic_code(num_files, int(size_mb * 1024 * 1024))
+    # A review that touches every file, so every file is audited.
+    reviewed_text = text.replace("Banana Shop", "The Banana Shop")
+    files = openapi.parse_files(text)
+    reviewed_files = openapi.parse_files(reviewed_text)
+
+    def fresh_dir(name):
+        path = os.path.join(workdir, name)
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        return path
+
+    def write_fresh(name):
+        path = fresh_dir(name)
+        openapi.write_files(files, path)
+        return path
+
+    # Each operation gets a setup (not timed) and a call (timed); both are run once for
+    # timing and once under tracemalloc.
+    operations = [
+        ("parse_files", lambda: None, lambda _: openapi.parse_files(text)),
+        ("write_files", lambda: fresh_dir("write"), lambda path: openapi.write_files(files, path)),
+        ("assemble_files (cold)", lambda: write_fresh("assemble_cold"), lambda path: openapi.assemble_files(path)),
+        ("assemble_files (warm)", lambda: write_fresh("assemble_warm"), None),
+        ("audited_write_files", lambda: write_fresh("audit"),
+         lambda path: openapi.audited_write_files(reviewed_files, path, max_workers=8)),
+        ("remove_triple_backtick_lines", lambda: write_fresh("fences"),
+         lambda path: parsing.remove_triple_backtick_lines(path)),
+    ]
+
+    rows = []
+    for name, setup, call in operations:
+        timings = {}
+        for with_memory in (False, True):
+            argument = setup()
+            if call is None:
+                # Warm snapshot: prime the index, then time a refresh where nothing changed.
+                openapi.assemble_files(argument)
+                call_fn = lambda: openapi.assemble_files(argument)
+            else:
+                call_fn = lambda: call(argument)
+            seconds, peak_mb, _ = measure(call_fn, with_memory)
+            if with_memory:
+                timings["peak_mb"] = round(peak_mb, 2)
+            else:
+                timings["seconds"] = round(seconds, 4)
+        rows.append({
+            "files": num_files,
+            "size_mb": size_mb,
+            "bytes": len(text),
+            "operation": name,
+            **timings,
+        })
+        print(f"{num_files:>6} files {size_mb:>6} MB  {name:<30} {timings['seconds']:>9.3f} s {timings['peak_mb']:>9.1f} MB")
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the orchestrator on synthetic projects.")
+    parser.add_argument("--files", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 10, 50], help="total project sizes in MB")
+    parser.add_argument("--output", default="bench_results.json", help="path of the JSON report")
+    args = parser.parse_args(argv)
+    output_path = os.path.abspath(args.output)
+
+    workdir = tempfile.mkdtemp(prefix="bench_orchestrator_")
+    previous_dir = os.getcwd()
+    # Import from the work directory so openapi's response cache and config lookups
+    # never touch the repository.
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    try:
+        import openapi
+        import parsing
+        import testing
+        from backends import StubBackend
+        openapi.set_backend(StubBackend())
+
+        results = []
+        for num_files in args.files:
+            for size_mb in args.sizes:
+                results.extend(bench_project(num_files, size_mb, workdir, openapi, testing, parsing))
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output_path}")
+
+if __name__ == "__main__":
+    main()
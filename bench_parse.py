@@ -0,0 +1,63 @@
+"""
+Benchmark the single-pass parser in parsing.py against the old regex-based parse_files.
+
+Usage: python bench_parse.py [size_in_mb ...]
+
+For each size, a synthetic model response is built from many file blocks and parsed by
+both implementations, once well-formed and once with every footer missing (the case
+where the lazy DOTALL regex backtracks over the rest of the output for each header).
+The regex already needs about a minute for 1 MB without footers, so it is only run on
+malformed inputs up to REGEX_MALFORMED_LIMIT_MB.
+"""
+import re
+import sys
+import time
+
+from parsing import parse_file_blocks
+
+REGEX_MALFORMED_LIMIT_MB = 0.5
+REGEX_PATTERN = r"### filename: (.*?) ###\s*(.*?)\s*### end ###"
+
+def regex_parse_files(text):
+    """The parse_files implementation that parsing.py replaced."""
+    matches = re.findall(REGEX_PATTERN, text, flags=re.DOTALL)
+    result = {}
+    for filename, content in matches:
+        result[filename.strip()] = content.strip()
+    return result
+
+def synthetic_output(size_bytes, terminated=True, lines_per_file=200):
+    """Build a model response of roughly size_bytes made of many file blocks."""
+    body_line = "    value = compute(value, index)  # synthetic line of generated code\n"
+    body = body_line * lines_per_file
+    footer = "### end ###\n" if terminated else ""
+    parts = []
+    total = 0
+    index = 0
+    while total < size_bytes:
+        block = f"### filename: pkg/module_{index}.py ###\n```python\n{body}```\n{footer}"
+        parts.append(block)
+        total += len(block)
+        index += 1
+    return "".join(parts), index
+
+def time_call(fn, text):
+    start = time.perf_counter()
+    fn(text)
+    return time.perf_counter() - start
+
+def main(sizes_mb):
+    print(f"{'size':>8} {'files':>7} {'format':>12} {'regex (s)':>10} {'single-pass (s)':>16}")
+    for size_mb in sizes_mb:
+        for terminated in (True, False):
+            text, count = synthetic_output(int(size_mb * 1024 * 1024), terminated=terminated)
+            if terminated or size_mb <= REGEX_MALFORMED_LIMIT_MB:
+                regex_time = f"{time_call(regex_parse_files, text):.3f}"
+            else:
+                regex_time = "skipped"
+            parser_time = time_call(parse_file_blocks, text)
+            label = "well-formed" if terminated else "no footers"
+            print(f"{size_mb:>6}MB {count:>7} {label:>12} {regex_time:>10} {parser_time:>16.3f}")
+
+if __name__ == "__main__":
+    main([float(arg) for arg in sys.argv[1:]] or [1, 4, 16])
@@ -0,0 +1,177 @@
+"""
+Check the orchestrator's retries against stub_server.py's injected faults.
+
+Usage: python check_rate_limit.py [--calls 40] [--audits 10] [--rate-limit-rate 0.3]
+                                  [--error-rate 0.1] [--retry-after 1] [--seed 1]
+
+Starts the stub server on a free port, answering a random fraction of requests with 429
+(with a Retry-After header) or 500, and sends model calls to it through the real OpenAI
+client (backends.OpenAIBackend, so the openai package is needed) and a RequestScheduler:
+first --calls direct scheduler calls, then a batch of --audits files through
+openapi.audited_write_files. It checks that
+
+- no call is sent more than max_retries + 1 times,
+- every 429 and 500 the server sent was either retried once or ended a call that had run
+  out of retries, and each audit retry is recorded exactly once in METRICS,
+- a retry after a 429 waits the server's Retry-After delay (capped at max_backoff), and
+  one after a 500 waits at most the capped exponential backoff.
+
+Problems are printed and the exit status is 1.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openapi
+import stub_server
+from backends import OpenAIBackend
+from rate_limit import RequestScheduler, status_code
+
+# Slack for timer and thread scheduling when comparing a measured wait with the planned delay.
+TOLERANCE = 0.05
+
+class RecordingScheduler(RequestScheduler):
+    """A RequestScheduler that records every attempt and every backoff delay, per call."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.current = threading.local()  # the call the current thread is making
+        self.attempts = {}  # call -> start time of each attempt
+        self.delays = {}  # call -> (status code, planned delay) of each retry
+        self.lock = threading.Lock()
+
+    def call(self, fn, stage=None, tokens=0, response_tokens=None, on_retry=None):
+        with self.lock:
+            call = f"{stage}-{len(self.attempts)}"
+            self.attempts[call] = []
+
+        def attempt():
+            self.current.call = call
+            with self.lock:
+                self.attempts[call].append(time.monotonic())
+            return fn()
+        return super().call(attempt, stage, tokens, response_tokens, on_retry)
+
+    def backoff_delay(self, attempt, error):
+        delay = super().backoff_delay(attempt, error)
+        with self.lock:
+            self.delays.setdefault(self.current.call, []).append((status_code(error), delay))
+        return delay
+
+def check_attempts(scheduler, retry_after):
+    """Check the number of attempts of every call and the wait before every retry."""
+    problems = []
+    for call, starts in scheduler.attempts.items():
+        delays = scheduler.delays.get(call, [])
+        if len(starts) > scheduler.max_retries + 1:
+            problems.append(f"call {call} was sent {len(starts)} times (max_retries is {scheduler.max_retries})")
+        if len(delays) != len(starts) - 1:
+            problems.append(f"call {call}: {len(starts)} attempts but {len(delays)} backoff delays")
+        for retry, ((status, delay), (previous, start)) in enumerate(zip(delays, zip(starts, starts[1:])), 1):
+            if status == 429:
+                expected = min(retry_after, scheduler.max_backoff)
+                if abs(delay - expected) > 1e-9:
+                    problems.append(f"call {call}: retry {retry} after a 429 planned {delay:.3f} s, not Retry-After {expected} s")
+            elif not 0 <= delay <= min(scheduler.max_backoff, scheduler.backoff * 2 ** (retry - 1)):
+                problems.append(f"call {call}: retry {retry} after a {status} planned {delay:.3f} s, outside the backoff range")
+            if start - previous < delay - TOLERANCE:
+                problems.append(f"call {call}: retry {retry} was sent {start - previous:.3f} s after the failure, planned {delay:.3f} s")
+    return problems
+
+def check_counts(name, counts, succeeded, failed, retries, max_attempts):
+    """
+    Every 429/500 is a retry or the last error of a failed call, every 200 a success, and no
+    call (e.g. an audit) made more than max_attempts requests in total.
+    """
+    problems = []
+    errors = counts.get(429, 0) + counts.get(500, 0)
+    if sum(counts.values()) > (succeeded + failed) * max_attempts:
+        problems.append(f"{name}: {succeeded + failed} calls made {sum(counts.values())} requests, "
+                        f"more than {max_attempts} each")
+    if errors != retries + failed:
+        problems.append(f"{name}: server sent {errors} errors, but {retries} retries were recorded and {failed} calls failed")
+    if counts.get(200, 0) != succeeded:
+        problems.append(f"{name}: server answered {counts.get(200, 0)} requests, but {succeeded} calls succeeded")
+    return problems
+
+def run_calls(scheduler, backend, calls):
+    """Send calls direct scheduler calls from several threads. Returns (succeeded, failed, retries)."""
+    retries = []
+
+    def one(index):
+        try:
+            scheduler.call(lambda: backend.complete(f"Review call {index}", openapi.DEFAULT_MODEL, "review"),
+                           "review", on_retry=lambda attempt, error: retries.append(attempt))
+            return True
+        except Exception:
+            return False
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(one, range(calls)))
+    return results.count(True), results.count(False), len(retries)
+
+def run_audits(audits, workdir):
+    """Audit a batch of changed files through openapi. Returns (succeeded, failed, retries)."""
+    originals = {f"page_{index}.html": f"<p>Banana {index}</p>\n" for index in range(audits)}
+    openapi.write_files(originals, workdir)
+    changed = {filename: content.replace("Banana", "Fresh banana") for filename, content in originals.items()}
+    openapi.METRICS.start()
+    failures = openapi.audited_write_files(changed, workdir, model=openapi.DEFAULT_MODEL)
+    retries = openapi.METRICS.summary().get("audit", {}).get("retries", 0)
+    return audits - len(failures), len(failures), retries
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the scheduler's retries against the fault-injecting stub server.")
+    parser.add_argument("--calls", type=int, default=40, help="direct scheduler calls")
+    parser.add_argument("--audits", type=int, default=10, help="files audited through audited_write_files")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.3, help="fraction of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="fraction of requests answered with 500")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    server = stub_server.make_server(port=0, rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate,
+                                     retry_after=args.retry_after, seed=args.seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    backend = OpenAIBackend(api_key="stub", base_url=base_url, timeout=30.0)
+    scheduler = RecordingScheduler(max_retries=3, backoff=0.2, max_backoff=5.0)
+    openapi.set_backend(backend)
+    openapi.SCHEDULER = scheduler
+
+    problems = []
+    try:
+        start = time.perf_counter()
+        succeeded, failed, retries = run_calls(scheduler, backend, args.calls)
+        problems += check_counts("scheduler calls", dict(stub_server.StubHandler.counts), succeeded, failed, retries,
+                                 scheduler.max_retries + 1)
+        openapi.safe_print(f"Scheduler calls: {succeeded} succeeded, {failed} failed, {retries} retries, "
+                           f"server answered {dict(sorted(stub_server.StubHandler.counts.items()))} "
+                           f"in {time.perf_counter() - start:.1f} s")
+
+        stub_server.StubHandler.counts = {}
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory(prefix="check_rate_limit_") as workdir:
+            succeeded, failed, retries = run_audits(args.audits, os.path.join(workdir, "website_files"))
+        problems += check_counts("audits", dict(stub_server.StubHandler.counts), succeeded, failed, retries,
+                                 scheduler.max_retries + 1)
+        openapi.safe_print(f"Audits: {succeeded} succeeded, {failed} failed, {retries} retries, "
+                           f"server answered {dict(sorted(stub_server.StubHandler.counts.items()))} "
+                           f"in {time.perf_counter() - start:.1f} s")
+        problems += check_attempts(scheduler, args.retry_after)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    for problem in problems:
+        openapi.safe_print(f"WARNING: {problem}")
+    openapi.safe_print(f"{sum(len(starts) for starts in scheduler.attempts.values())} requests checked, "
+                       f"{len(problems)} problems.")
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
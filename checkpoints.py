@@ -0,0 +1,62 @@
+import gzip
+import json
+import os
+import re
+
+class CheckpointStore:
+    """
+    Stores one gzip-compressed JSON checkpoint per pipeline iteration, e.g.
+    json_outputs/checkpoint_iter1.json.gz. Each checkpoint holds the iteration's state
+    (prompts, model outputs and the list of completed stages) and is rewritten after
+    every stage. Writes go to a temporary file that is then renamed into place, so a
+    crash while saving never leaves a half-written checkpoint behind.
+    """
+
+    def __init__(self, directory="json_outputs", prefix="checkpoint_iter"):
+        self.directory = directory
+        self.prefix = prefix
+        self._pattern = re.compile(re.escape(prefix) + r"(\d+)\.json\.gz$")
+
+    def path(self, iteration):
+        """Return the checkpoint path for a 0-based iteration (file names are 1-based)."""
+        return os.path.join(self.directory, f"{self.prefix}{iteration + 1}.json.gz")
+
+    def save(self, iteration, state):
+        """Write the state of an iteration."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(iteration)
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    def load(self, iteration):
+        """Return the saved state of an iteration, or None if there is no checkpoint for it."""
+        path = self.path(iteration)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def iterations(self):
+        """Return the sorted 0-based iterations that have a checkpoint."""
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for filename in os.listdir(self.directory):
+            match = self._pattern.match(filename)
+            if match:
+                found.append(int(match.group(1)) - 1)
+        return sorted(found)
+
+    def latest(self):
+        """Return (iteration, state) for the most recent checkpoint, or (None, None) if there is none."""
+        iterations = self.iterations()
+        if not iterations:
+            return None, None
+        return iterations[-1], self.load(iterations[-1])
+
+    def clear(self):
+        """Delete all checkpoints written by this store."""
+        for iteration in self.iterations():
+            os.remove(self.path(iteration))
@@ -0,0 +1,107 @@
+import os
+
+from parsing import parse_file_blocks
+
+# Rough token estimate used for budgeting; about 4 characters per token for code and English.
+CHARS_PER_TOKEN = 4
+# File names that are always worth showing the model first.
+ENTRY_POINTS = {"app.py", "main.py", "server.py", "manage.py", "wsgi.py", "index.html", "requirements.txt"}
+# Tokens reserved for the list of omitted files.
+SUMMARY_RESERVE_TOKENS = 200
+
+def estimate_tokens(text):
+    """Estimate the number of tokens in a piece of text."""
+    return estimate_tokens_for_length(len(text))
+
+def estimate_tokens_for_length(length):
+    """Estimate the number of tokens in a text of length characters."""
+    return (length + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def render_file(path, content):
+    """Render one file in the custom file format."""
+    return f"### filename: {path} ###\n{content}\n### end ###\n"
+
+def rank_files(files, changed=(), feedback=""):
+    """
+    Return the file paths ordered by relevance, most relevant first:
+    changed files, then files mentioned in the feedback, then entry points like app.py.
+    Ties are broken by size (smaller first, so more files fit) and then by path.
+    """
+    changed = set(changed)
+
+    def score(path):
+        name = os.path.basename(path)
+        value = 0
+        if path in changed:
+            value += 4
+        if feedback and (path in feedback or name in feedback):
+            value += 2
+        if name in ENTRY_POINTS:
+            value += 1
+        return (-value, len(files[path]), path)
+
+    return sorted(files, key=score)
+
+def pack_files(files, budget_tokens, changed=(), feedback="", stage="prompt"):
+    """
+    Render as many files as fit in budget_tokens, most relevant first (see rank_files).
+    Files that do not fit are listed by name and size at the end instead of being pasted in full.
+
+    Returns (text, report), where report is a dictionary with the stage name, the budget,
+    the estimated tokens sent and the included and omitted file paths.
+    """
+    included = []
+    omitted = []
+    parts = []
+    used = 0
+    for path in rank_files(files, changed, feedback):
+        block = render_file(path, files[path])
+        tokens = estimate_tokens(block)
+        if used + tokens <= budget_tokens - SUMMARY_RESERVE_TOKENS or (not parts and tokens <= budget_tokens):
+            parts.append(block)
+            included.append(path)
+            used += tokens
+        else:
+            omitted.append(path)
+
+    if omitted:
+        lines = ["Files omitted to fit the context budget (their current versions are kept as they are):"]
+        lines.extend(
+            f"- {path} ({files[path].count(chr(10)) + 1} lines, ~{estimate_tokens(files[path])} tokens)"
+            for path in sorted(omitted)
+        )
+        parts.append("\n".join(lines) + "\n")
+
+    text = "".join(parts)
+    report = {
+        "stage": stage,
+        "budget_tokens": budget_tokens,
+        "tokens_sent": estimate_tokens(text),
+        "files_included": included,
+        "files_omitted": sorted(omitted),
+    }
+    return text, report
+
+def pack_code_text(code_text, budget_tokens, changed=(), feedback="", stage="prompt"):
+    """
+    Same as pack_files, for code that is already rendered in the custom file format
+    (for example a model response). Text that contains no file blocks is returned unchanged.
+    """
+    files, _ = parse_file_blocks(code_text, strip_fences=False)
+    if not files:
+        return code_text, {
+            "stage": stage,
+            "budget_tokens": budget_tokens,
+            "tokens_sent": estimate_tokens(code_text),
+            "files_included": [],
+            "files_omitted": [],
+        }
+    return pack_files(files, budget_tokens, changed, feedback, stage)
+
+def format_report(report):
+    """Return a one-line summary of a pack_files report."""
+    return (
+        f"Context [{report['stage']}]: ~{report['tokens_sent']} tokens sent "
+        f"(budget {report['budget_tokens']}), {len(report['files_included'])} files included, "
+        f"{len(report['files_omitted'])} omitted"
+    )
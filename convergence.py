@@ -0,0 +1,90 @@
+import ast
+import difflib
+import json
+import os
+import re
+
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# Short, common words that say nothing about what a suggestion is about.
+STOP_WORDS = {
+    "a", "an", "the", "and", "or", "to", "of", "in", "on", "for", "with", "is", "are", "be",
+    "it", "that", "this", "as", "by", "should", "can", "add", "ensure", "use", "make",
+}
+
+def normalize_file(path, content):
+    """
+    Turn a file into a list of tokens for comparison, ignoring formatting.
+    Python files are compared by their AST (so comments, blank lines and quoting style
+    don't count); other files, and Python that doesn't parse, by their code tokens.
+    """
+    if path.endswith(".py"):
+        try:
+            return TOKEN_PATTERN.findall(ast.dump(ast.parse(content)))
+        except (SyntaxError, ValueError):
+            pass
+    return TOKEN_PATTERN.findall(content)
+
+def token_delta(old_tokens, new_tokens):
+    """Return the fraction of tokens that changed, from 0.0 (identical) to 1.0 (nothing in common)."""
+    if old_tokens == new_tokens:
+        return 0.0
+    return 1.0 - difflib.SequenceMatcher(None, old_tokens, new_tokens).ratio()
+
+def code_delta(old_files, new_files):
+    """
+    Size-weighted change ratio between two versions of a project (dictionaries mapping
+    paths to content). Added and removed files count as fully changed.
+    Returns (delta, changed_paths).
+    """
+    total = 0
+    weighted = 0.0
+    changed = []
+    for path in sorted(set(old_files) | set(new_files)):
+        old_tokens = normalize_file(path, old_files[path]) if path in old_files else []
+        new_tokens = normalize_file(path, new_files[path]) if path in new_files else []
+        size = max(len(old_tokens), len(new_tokens), 1)
+        delta = token_delta(old_tokens, new_tokens) if path in old_files and path in new_files else 1.0
+        total += size
+        weighted += delta * size
+        if delta > 0:
+            changed.append(path)
+    return (weighted / total if total else 0.0), changed
+
+def suggestion_terms(analysis):
+    """Return the set of meaningful lowercase words in a gap analysis."""
+    return {word for word in WORD_PATTERN.findall(analysis.lower()) if word not in STOP_WORDS}
+
+def suggestion_delta(old_analysis, new_analysis):
+    """Jaccard distance between the word sets of two gap analyses (0.0 = same topics)."""
+    old_terms = suggestion_terms(old_analysis)
+    new_terms = suggestion_terms(new_analysis)
+    if not old_terms and not new_terms:
+        return 0.0
+    return 1.0 - len(old_terms & new_terms) / len(old_terms | new_terms)
+
+def measure_convergence(iteration, old_files, new_files, old_analysis, new_analysis,
+                        code_threshold=0.02, suggestion_threshold=0.6):
+    """
+    Compare one iteration's aggregated files and gap analysis with the previous ones.
+    The run has converged when the code change ratio is below code_threshold and the
+    gap-analysis suggestions changed less than suggestion_threshold.
+    Returns a metrics dictionary that can be charted per iteration.
+    """
+    delta, changed = code_delta(old_files, new_files)
+    analysis_delta = suggestion_delta(old_analysis, new_analysis) if old_analysis else 1.0
+    return {
+        "iteration": iteration,
+        "code_delta": round(delta, 4),
+        "suggestion_delta": round(analysis_delta, 4),
+        "files_changed": changed,
+        "converged": bool(old_files) and delta < code_threshold and analysis_delta < suggestion_threshold,
+    }
+
+def record_metrics(metrics, path):
+    """Append one metrics dictionary to a JSON Lines file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(metrics) + "\n")
@@ -0,0 +1,238 @@
+"""
+Versioned, deduplicated history of generated application trees.
+
+Usage: python history.py [--store json_outputs/history] list
+       python history.py [--store ...] stats
+       python history.py [--store ...] diff OLD NEW [--patch]
+       python history.py [--store ...] checkout VERSION TARGET_DIR [--clean]
+
+Like a tiny git: every file is stored once as a compressed blob named by the SHA-256 of its
+content, and each version (one per pipeline iteration) is a small JSON manifest mapping paths
+to blob hashes. Storing several near-identical copies of a project only costs the blobs of
+the files that actually changed, plus one manifest per version.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+import zlib
+
+from merging import unified_diff
+from workspace import IGNORED_DIRS, is_ignored
+
+class HistoryStore:
+    """
+    Content-addressed store: directory/objects/ab/cdef... holds zlib-compressed blobs and
+    directory/manifests/v0001.json the manifest of each version. Blobs and manifests are
+    written to a temporary file and renamed into place, so an interrupted write never
+    leaves a corrupt object behind.
+    """
+
+    def __init__(self, directory="history"):
+        self.directory = directory
+        self.objects = os.path.join(directory, "objects")
+        self.manifests = os.path.join(directory, "manifests")
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def blob_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def put_blob(self, data):
+        """Store bytes (once) and return their SHA-256 hex digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            self._write(path, zlib.compress(data, 6))
+        return digest
+
+    def get_blob(self, digest):
+        with open(self.blob_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def manifest_path(self, version):
+        return os.path.join(self.manifests, f"v{version:04d}.json")
+
+    def versions(self):
+        """Return the sorted version numbers in the store."""
+        if not os.path.isdir(self.manifests):
+            return []
+        return sorted(
+            int(name[1:-5]) for name in os.listdir(self.manifests)
+            if name.startswith("v") and name.endswith(".json") and name[1:-5].isdigit()
+        )
+
+    def manifest(self, version):
+        """Return the manifest of a version: {"version", "created", "metadata", "files": {path: digest}}."""
+        with open(self.manifest_path(version), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def snapshot(self, source_directory, metadata=None):
+        """
+        Record the files under source_directory (skipping the directories and file patterns a
+        workspace snapshot ignores) as a new version. Returns the new version number.
+        """
+        files = {}
+        for root, dirs, filenames in os.walk(source_directory):
+            dirs[:] = sorted(d for d in dirs if d not in IGNORED_DIRS)
+            for filename in sorted(filenames):
+                if is_ignored(filename):
+                    continue
+                file_path = os.path.join(root, filename)
+                with open(file_path, "rb") as f:
+                    data = f.read()
+                relative_path = os.path.relpath(file_path, source_directory).replace(os.sep, "/")
+                files[relative_path] = self.put_blob(data)
+
+        versions = self.versions()
+        version = versions[-1] + 1 if versions else 1
+        manifest = {
+            "version": version,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "metadata": metadata or {},
+            "files": files,
+        }
+        self._write(self.manifest_path(version), json.dumps(manifest, indent=1).encode("utf-8"))
+        return version
+
+    def checkout(self, version, target_directory, clean=False):
+        """
+        Make target_directory match a version. Only files whose content differs are written;
+        with clean=True, files that are not part of the version are deleted.
+        Returns (written, removed) lists of relative paths.
+        """
+        files = self.manifest(version)["files"]
+        written = []
+        for path, digest in sorted(files.items()):
+            file_path = os.path.join(target_directory, *path.split("/"))
+            if os.path.exists(file_path):
+                with open(file_path, "rb") as f:
+                    if hashlib.sha256(f.read()).hexdigest() == digest:
+                        continue
+            self._write(file_path, self.get_blob(digest))
+            written.append(path)
+
+        removed = []
+        if clean and os.path.isdir(target_directory):
+            for root, dirs, filenames in os.walk(target_directory):
+                dirs[:] = [d for d in dirs if d not in IGNORED_DIRS]
+                for filename in filenames:
+                    file_path = os.path.join(root, filename)
+                    path = os.path.relpath(file_path, target_directory).replace(os.sep, "/")
+                    if path not in files and not is_ignored(filename):
+                        os.remove(file_path)
+                        removed.append(path)
+        return written, sorted(removed)
+
+    def diff(self, old_version, new_version):
+        """Return {"added": [...], "removed": [...], "modified": [...]} paths between two versions."""
+        old_files = self.manifest(old_version)["files"]
+        new_files = self.manifest(new_version)["files"]
+        return {
+            "added": sorted(set(new_files) - set(old_files)),
+            "removed": sorted(set(old_files) - set(new_files)),
+            "modified": sorted(
+                path for path in set(old_files) & set(new_files) if old_files[path] != new_files[path]
+            ),
+        }
+
+    def patch(self, old_version, new_version):
+        """Return a unified diff of every text file that changed between two versions."""
+        old_files = self.manifest(old_version)["files"]
+        new_files = self.manifest(new_version)["files"]
+        parts = []
+        for path in sorted(set(old_files) | set(new_files)):
+            if old_files.get(path) == new_files.get(path):
+                continue
+            try:
+                old_text = self.get_blob(old_files[path]).decode("utf-8") if path in old_files else ""
+                new_text = self.get_blob(new_files[path]).decode("utf-8") if path in new_files else ""
+            except UnicodeDecodeError:
+                parts.append(f"Binary file {path} differs\n")
+                continue
+            parts.append(unified_diff(path, old_text, new_text))
+        return "".join(parts)
+
+    def stats(self):
+        """
+        Storage statistics: versions, file entries across all manifests, unique blobs,
+        the bytes all versions would take as plain copies (logical) and the bytes actually
+        stored (compressed blobs plus manifests).
+        """
+        referenced = {}
+        entries = 0
+        manifest_bytes = 0
+        for version in self.versions():
+            manifest_bytes += os.path.getsize(self.manifest_path(version))
+            for digest in self.manifest(version)["files"].values():
+                entries += 1
+                referenced[digest] = referenced.get(digest, 0) + 1
+
+        logical_bytes = 0
+        blob_bytes = 0
+        blobs = 0
+        if os.path.isdir(self.objects):
+            for root, _, filenames in os.walk(self.objects):
+                for filename in filenames:
+                    if filename.endswith(".tmp"):
+                        continue
+                    digest = os.path.basename(root) + filename
+                    path = os.path.join(root, filename)
+                    blobs += 1
+                    blob_bytes += os.path.getsize(path)
+                    if digest in referenced:
+                        logical_bytes += len(self.get_blob(digest)) * referenced[digest]
+        stored_bytes = blob_bytes + manifest_bytes
+        return {
+            "versions": len(self.versions()),
+            "file_entries": entries,
+            "blobs": blobs,
+            "logical_bytes": logical_bytes,
+            "stored_bytes": stored_bytes,
+            "ratio": round(logical_bytes / stored_bytes, 2) if stored_bytes else None,
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect the history of generated application trees.")
+    parser.add_argument("--store", default=os.path.join("json_outputs", "history"), help="history directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list the versions")
+    commands.add_parser("stats", help="show storage statistics")
+    diff_parser = commands.add_parser("diff", help="compare two versions")
+    diff_parser.add_argument("old", type=int)
+    diff_parser.add_argument("new", type=int)
+    diff_parser.add_argument("--patch", action="store_true", help="print a unified diff")
+    checkout_parser = commands.add_parser("checkout", help="write a version into a directory")
+    checkout_parser.add_argument("version", type=int)
+    checkout_parser.add_argument("target")
+    checkout_parser.add_argument("--clean", action="store_true", help="delete files not in the version")
+    args = parser.parse_args(argv)
+
+    store = HistoryStore(args.store)
+    if args.command == "list":
+        for version in store.versions():
+            manifest = store.manifest(version)
+            metadata = ", ".join(f"{key}={value}" for key, value in manifest["metadata"].items())
+            print(f"v{version}  {manifest['created']}  {len(manifest['files'])} files  {metadata}")
+    elif args.command == "stats":
+        for key, value in store.stats().items():
+            print(f"{key}: {value}")
+    elif args.command == "diff":
+        if args.patch:
+            print(store.patch(args.old, args.new), end="")
+        else:
+            for kind, paths in store.diff(args.old, args.new).items():
+                for path in paths:
+                    print(f"{kind[0].upper()} {path}")
+    else:
+        written, removed = store.checkout(args.version, args.target, clean=args.clean)
+        print(f"Checked out v{args.version} into {args.target}: {len(written)} written, {len(removed)} removed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import difflib
+
+from parsing import parse_file_blocks
+
+def change_hunks(base_lines, other_lines):
+    """
+    Return the changes that turn base_lines into other_lines as a list of
+    (start, end, replacement_lines) tuples in base line coordinates.
+    """
+    matcher = difflib.SequenceMatcher(None, base_lines, other_lines, autojunk=False)
+    return [
+        (i1, i2, other_lines[j1:j2])
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+def three_way_merge(base, ours, theirs):
+    """
+    Line-based three-way merge of two edited versions of the same base text.
+    Non-overlapping changes from both sides are combined. Changes that overlap or touch
+    the same lines conflict, unless both sides made exactly the same change.
+    Returns (merged_text, clean); merged_text is None when there is a conflict.
+    """
+    if ours == theirs or theirs == base:
+        return ours, True
+    if ours == base:
+        return theirs, True
+
+    base_lines = base.split("\n")
+    hunks = sorted(
+        [(start, end, lines, 0) for start, end, lines in change_hunks(base_lines, ours.split("\n"))] +
+        [(start, end, lines, 1) for start, end, lines in change_hunks(base_lines, theirs.split("\n"))],
+        key=lambda hunk: (hunk[0], hunk[1])
+    )
+
+    merged = []
+    position = 0
+    previous = None
+    for start, end, lines, side in hunks:
+        if previous is not None and start <= previous[1] and previous[0] <= end:
+            if (start, end, lines) == previous[:3]:
+                continue
+            if previous[3] != side:
+                return None, False
+        merged.extend(base_lines[position:start])
+        merged.extend(lines)
+        position = max(position, end)
+        previous = (start, end, lines, side)
+    merged.extend(base_lines[position:])
+    return "\n".join(merged), True
+
+def unified_diff(path, original, revised):
+    """Return a unified diff of one file, labelled with its path."""
+    return "".join(difflib.unified_diff(
+        original.splitlines(keepends=True), revised.splitlines(keepends=True),
+        fromfile=f"a/{path}", tofile=f"b/{path}"
+    ))
+
+def merge_reviews(original_code, reviews):
+    """
+    Merge reviewer outputs into the original locally, file by file.
+
+    A file a reviewer did not return counts as unchanged by that reviewer. When every
+    reviewer left a file alone, or they all made the same change, or only one reviewer
+    changed it, the result is taken directly. Otherwise the reviewers' changes are combined
+    with three_way_merge; if they overlap, the file is a conflict.
+
+    Returns (merged_files, conflicts, stats): merged_files maps paths to merged content,
+    conflicts maps each conflicting path to (original_content, [reviewer versions]), and
+    stats counts files per outcome ("unchanged", "single", "merged", "conflict").
+    """
+    original_files, _ = parse_file_blocks(original_code)
+    review_files = [parse_file_blocks(review)[0] for review in reviews]
+
+    paths = list(original_files)
+    for files in review_files:
+        paths.extend(path for path in files if path not in original_files and path not in paths)
+
+    merged_files = {}
+    conflicts = {}
+    stats = {"unchanged": 0, "single": 0, "merged": 0, "conflict": 0}
+    for path in paths:
+        base = original_files.get(path, "")
+        versions = [files.get(path, base) for files in review_files]
+        changed = []
+        for version in versions:
+            if version != base and version not in changed:
+                changed.append(version)
+
+        if not changed:
+            merged_files[path] = base
+            stats["unchanged"] += 1
+            continue
+        if len(changed) == 1:
+            merged_files[path] = changed[0]
+            stats["single"] += 1
+            continue
+
+        merged = changed[0]
+        clean = True
+        for version in changed[1:]:
+            merged, clean = three_way_merge(base, merged, version)
+            if not clean:
+                break
+        if clean:
+            merged_files[path] = merged
+            stats["merged"] += 1
+        else:
+            conflicts[path] = (base, versions)
+            stats["conflict"] += 1
+
+    return merged_files, conflicts, stats
@@ -0,0 +1,167 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from context_packing import estimate_tokens
+
+# US dollars per million (prompt, completion) tokens; override or extend in config.json
+# with "model_prices", e.g. {"o1-mini": [3.0, 12.0]}. Models without a price cost 0.
+DEFAULT_PRICES = {
+    "o1-mini": (3.0, 12.0),
+    "o1-preview": (15.0, 60.0),
+}
+
+# The pipeline stage and the batch job (see batch.py) the current code is running for. Thread
+# pools that do work for a stage submit it with contextvars.copy_context().run, so both carry
+# over to their worker threads.
+CURRENT_STAGE = contextvars.ContextVar("stage", default=None)
+CURRENT_JOB = contextvars.ContextVar("job", default=None)
+
+class MetricsRecorder:
+    """
+    Collects structured metrics for one run: one event per model call (stage, model, prompt
+    size, estimated prompt and completion tokens, latency, cost, whether it was served from the
+    cache, and the error if it failed), one per retry, and one per timed piece of local work
+    (parsing, writing, fence stripping).
+
+    Events are kept in memory for summary() and, once start() has been given a path, appended
+    to that file as JSON Lines as they happen. Safe to use from several threads.
+    When several pipelines run at once (see batch.py), every event is tagged with its
+    CURRENT_JOB and written to that job's file.
+    Token counts are estimates (see context_packing.estimate_tokens), since backends only
+    return the response text.
+    """
+
+    def __init__(self, prices=None):
+        self.prices = dict(DEFAULT_PRICES)
+        self.prices.update({model: tuple(price) for model, price in (prices or {}).items()})
+        self.paths = {}
+        self.events = []
+        self._lock = threading.Lock()
+
+    def start(self, path=None, reset=True):
+        """
+        Start a run of the current job: write its events to path (if given). With reset, the
+        job's earlier events and the file are discarded; otherwise (e.g. when resuming) the
+        events already in the file are loaded.
+        """
+        job = CURRENT_JOB.get()
+        with self._lock:
+            self.paths[job] = path
+            self.events = [event for event in self.events if event.get("job") != job]
+            if not path or not os.path.exists(path):
+                return
+            if reset:
+                os.remove(path)
+                return
+            with open(path, "r", encoding="utf-8") as f:
+                self.events.extend(json.loads(line) for line in f if line.strip())
+
+    def current_stage(self):
+        return CURRENT_STAGE.get()
+
+    def record(self, kind, **fields):
+        event = {"time": round(time.time(), 3), "kind": kind, **fields}
+        job = CURRENT_JOB.get()
+        if job is not None:
+            event["job"] = job
+        with self._lock:
+            self.events.append(event)
+            path = self.paths.get(job)
+            if path:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event) + "\n")
+        return event
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        prompt_price, completion_price = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+    def model_call(self, stage, model, prompt, response, seconds, cached=False, error=None,
+                   first_chunk_seconds=None):
+        """Record one model call. A failed call has response None and the exception as error."""
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(response) if response is not None else 0
+        fields = {
+            "stage": stage or self.current_stage(),
+            "model": model,
+            "prompt_chars": len(prompt),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "seconds": round(seconds, 4),
+            "cached": cached,
+            "cost": 0.0 if cached else round(self.cost(model, prompt_tokens, completion_tokens), 6),
+        }
+        if first_chunk_seconds is not None:
+            fields["first_chunk_seconds"] = round(first_chunk_seconds, 4)
+        if error is not None:
+            fields["error"] = f"{type(error).__name__}: {error}"
+        return self.record("model_call", **fields)
+
+    def retry(self, stage, attempt, error):
+        """Record that a failed call of a stage is being retried (attempt is 1 for the first retry)."""
+        return self.record("retry", stage=stage or self.current_stage(), attempt=attempt,
+                           error=f"{type(error).__name__}: {error}")
+
+    @contextmanager
+    def timer(self, operation, stage=None, **fields):
+        """Time a block of local work, e.g. `with METRICS.timer("parse"): ...`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record("local", stage=stage or self.current_stage(), operation=operation,
+                        seconds=round(time.perf_counter() - start, 4), **fields)
+
+    def summary(self, job=None, all_jobs=False):
+        """
+        Totals per stage of one job (or of all jobs), in the order the stages first appeared:
+        model calls, cached calls, errors, retries, estimated tokens, model and local seconds and cost.
+        """
+        totals = {}
+        with self._lock:
+            events = [event for event in self.events if all_jobs or event.get("job") == job]
+        for event in events:
+            row = totals.setdefault(event.get("stage") or "-", {
+                "calls": 0, "cached": 0, "errors": 0, "retries": 0, "prompt_tokens": 0,
+                "completion_tokens": 0, "model_seconds": 0.0, "local_seconds": 0.0, "cost": 0.0,
+            })
+            if event["kind"] == "model_call":
+                row["calls"] += 1
+                row["cached"] += event["cached"]
+                row["errors"] += "error" in event
+                row["prompt_tokens"] += event["prompt_tokens"]
+                row["completion_tokens"] += event["completion_tokens"]
+                row["model_seconds"] += event["seconds"]
+                row["cost"] += event["cost"]
+            elif event["kind"] == "retry":
+                row["retries"] += 1
+            elif event["kind"] == "local":
+                row["local_seconds"] += event["seconds"]
+        return totals
+
+def format_summary(totals):
+    """Return a printable table of summary() totals with a total row."""
+    columns = ["calls", "cached", "errors", "retries", "prompt_tokens", "completion_tokens",
+               "model_seconds", "local_seconds", "cost"]
+    headers = ["calls", "cached", "errors", "retries", "prompt tok", "compl tok", "model (s)", "local (s)", "cost ($)"]
+    overall = {column: sum(row[column] for row in totals.values()) for column in columns}
+
+    def line(name, row):
+        cells = [
+            f"{row[column]:>10.2f}" if column.endswith("seconds") else
+            f"{row[column]:>10.4f}" if column == "cost" else f"{row[column]:>10}"
+            for column in columns
+        ]
+        return f"  {name:<14}" + " ".join(cells)
+
+    lines = [f"  {'stage':<14}" + " ".join(f"{header:>10}" for header in headers)]
+    lines.extend(line(stage, row) for stage, row in totals.items())
+    lines.append(line("total", overall))
+    return "\n".join(lines)
@@ -1,13 +1,111 @@
-import openai
-import json  # Only used to load the API key.
+import argparse
+import json  # Used to load config.json.
 import os
-import re
 import sys
-
-# Load the OpenAI API key from a config file.
-with open("config.json", "r") as config_file:
-    config = json.load(config_file)
-openai.api_key = config["api_key"]
+import threading
+import time
+
+from atomic_writes import FileTransaction, read_existing, write_files_atomically
+from auditing import CHANGED, UNCHANGED, classify_change, run_audits
+from backends import make_backend
+from checkpoints import CheckpointStore
+from context_packing import estimate_tokens, estimate_tokens_for_length, format_report, pack_code_text, pack_files, render_file
+from convergence import measure_convergence, record_metrics
+from history import HistoryStore
+from merging import merge_reviews, unified_diff
+from metrics import CURRENT_JOB, CURRENT_STAGE, MetricsRecorder, format_summary
+from parsing import StreamingFileParser, format_diagnostic, parse_file_blocks, strip_code_fences_from_text
+from rate_limit import RequestScheduler
+from response_cache import CacheMissError, ResponseCache
+from reviews import reviewer_prompt_list, run_reviews
+from stage_graph import StageGraph, format_trace
+from workspace import get_snapshot
+
+def load_config(config_path="config.json"):
+    """
+    Load settings (the OpenAI API key, the model backend and optional tuning values) from a JSON config file.
+    A missing file gives an empty config, so this module can be imported without an API key.
+    """
+    if os.path.exists(config_path):
+        with open(config_path, "r") as config_file:
+            return json.load(config_file)
+    return {}
+
+# Load the OpenAI API key and other settings from a config file.
+config = load_config()
+
+# The backend every model call goes through; see backends.make_backend for the options
+# of the "backend" section of config.json. It is created on first use.
+MODEL_BACKEND = None
+
+def get_backend():
+    """Return the model backend, creating it from config.json on first use."""
+    global MODEL_BACKEND
+    if MODEL_BACKEND is None:
+        MODEL_BACKEND = make_backend(config.get("backend", {}), api_key=config.get("api_key"))
+    return MODEL_BACKEND
+
+def set_backend(backend):
+    """Use the given backends.ModelBackend for all following model calls."""
+    global MODEL_BACKEND
+    MODEL_BACKEND = backend
+
+# Cache of model responses keyed by (model, prompt, variant). It is off unless enabled with
+# --cache or --cache-replay, or with "enabled": true in the optional "response_cache" section of
+# config.json, so a new run asks the model again instead of replaying an old generation.
+# Entries expire after "max_age_days" (7 by default); "replay": true (or --cache-replay) runs
+# only from recorded responses.
+cache_config = config.get("response_cache", {})
+RESPONSE_CACHE = None
+
+def enable_response_cache(replay=False):
+    """Open RESPONSE_CACHE from the "response_cache" settings; with replay=True, read-only."""
+    global RESPONSE_CACHE
+    max_age_days = cache_config.get("max_age_days", 7)
+    RESPONSE_CACHE = ResponseCache(
+        cache_config.get("path", "response_cache.db"),
+        max_entries=cache_config.get("max_entries"),
+        max_bytes=cache_config.get("max_bytes"),
+        max_age_seconds=max_age_days * 86400 if max_age_days is not None else None,
+        read_only=replay or cache_config.get("replay", False),
+    )
+    return RESPONSE_CACHE
+
+def add_cache_arguments(parser):
+    parser.add_argument("--cache", action="store_true",
+                        help="reuse cached model responses for identical prompts and cache new ones")
+    parser.add_argument("--cache-replay", action="store_true",
+                        help="run only from cached responses; an uncached prompt is an error")
+
+def configure_response_cache(args):
+    """Enable RESPONSE_CACHE if the command line (see add_cache_arguments) or config.json asks for it."""
+    if args.cache or args.cache_replay or cache_config.get("enabled", False):
+        enable_response_cache(replay=args.cache_replay)
+
+# Per-call latency, token and cost metrics and timings of local work; see metrics.MetricsRecorder.
+# Prices per million tokens can be set with "model_prices" in config.json.
+METRICS = MetricsRecorder(prices=config.get("model_prices"))
+
+# Shared client-side rate limiting, priorities and retries for every model call; configured with
+# the optional "rate_limit" section of config.json, e.g. {"requests_per_minute": 500,
+# "tokens_per_minute": 200000, "max_concurrent": 8, "max_retries": 4, "backoff_seconds": 1.0}.
+rate_limit_config = config.get("rate_limit", {})
+SCHEDULER = RequestScheduler(
+    requests_per_minute=rate_limit_config.get("requests_per_minute"),
+    tokens_per_minute=rate_limit_config.get("tokens_per_minute"),
+    max_concurrent=rate_limit_config.get("max_concurrent"),
+    max_retries=rate_limit_config.get("max_retries", 4),
+    backoff=rate_limit_config.get("backoff_seconds", 1.0),
+    max_backoff=rate_limit_config.get("max_backoff_seconds", 30.0),
+    priorities=rate_limit_config.get("priorities"),
+)
+
+def record_retry(stage):
+    """Return an on_retry callback that reports a retry of the given stage."""
+    def on_retry(attempt, error):
+        METRICS.retry(stage, attempt, error)
+        safe_print(f"Retrying {stage or 'model'} call (attempt {attempt + 1}) after {type(error).__name__}: {error}")
+    return on_retry
 
 # Reconfigure sys.stdout to use UTF-8 (available in Python 3.7+)
 try:
@@ -15,32 +113,97 @@ try:
 except Exception:
     pass
 
-def remove_triple_backtick_lines(directory):
-    """
-    Walk through the given directory and its subdirectories.
-    For each .html, .js, .css, .py, .txt, or .log file found,
-    remove any lines that contain triple backticks ('```'),
-    then overwrite the file with the filtered content.
-    """
-    for root, dirs, files in os.walk(directory):
-        for filename in files:
-            if filename.endswith(('.html', '.js', '.css', '.py', '.txt', '.log')):
-                file_path = os.path.join(root, filename)
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                filtered_lines = [line for line in lines if '```' not in line]
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.writelines(filtered_lines)
+PRINT_LOCK = threading.Lock()
 
 def safe_print(text):
     """
     Print text using UTF-8 encoding. If a UnicodeEncodeError occurs,
-    replace invalid characters.
+    replace invalid characters. In batch mode, every line is prefixed with the job name.
+    """
+    job = CURRENT_JOB.get()
+    if job is not None:
+        text = "\n".join(f"[{job}] {line}" for line in str(text).split("\n"))
+    with PRINT_LOCK:  # Stages run concurrently; keep their lines from interleaving.
+        try:
+            print(text)
+        except UnicodeEncodeError:
+            print(text.encode('utf-8', errors='replace').decode('utf-8'))
+
+def chat_completion(prompt, model, stage=None, cache_variant=None):
+    """
+    Send a single-message chat completion request through the model backend and return the response text.
+    Responses are served from and stored in RESPONSE_CACHE when it is enabled and the backend is cacheable;
+    calls with a different cache_variant never share a cached response.
+    In replay mode, a prompt that was never recorded raises CacheMissError instead of calling the API.
+    Calls go through SCHEDULER, which enforces the rate limits and retries rate-limit errors,
+    timeouts and server errors. Every call, cached or failed ones included, is recorded in METRICS.
     """
+    backend = get_backend()
+    cache = RESPONSE_CACHE if backend.cacheable else None
+    start = time.perf_counter()
+    if cache is not None:
+        cached = cache.get(model, prompt, cache_variant)
+        if cached is not None:
+            METRICS.model_call(stage, model, prompt, cached, time.perf_counter() - start, cached=True)
+            return cached
+        if cache.read_only:
+            raise CacheMissError(f"No recorded response for this {model} prompt in replay mode.")
     try:
-        print(text)
-    except UnicodeEncodeError:
-        print(text.encode('utf-8', errors='replace').decode('utf-8'))
+        content = SCHEDULER.call(
+            lambda: backend.complete(prompt, model, stage), stage,
+            tokens=estimate_tokens(prompt), response_tokens=estimate_tokens, on_retry=record_retry(stage),
+        )
+    except Exception as e:
+        METRICS.model_call(stage, model, prompt, None, time.perf_counter() - start, error=e)
+        raise
+    METRICS.model_call(stage, model, prompt, content, time.perf_counter() - start)
+    if cache is not None:
+        cache.put(model, prompt, content, cache_variant)
+    return content
+
+def chat_completion_stream(prompt, model, stage=None):
+    """
+    Streaming version of chat_completion: yield the response text in chunks as they arrive.
+    The generator's return value (the value of its StopIteration) is the whole response,
+    so callers don't need to keep the chunks themselves.
+    A cached response is yielded as a single chunk. The full response is stored in
+    RESPONSE_CACHE once the stream has been consumed completely. SCHEDULER retries a failed
+    stream only if nothing has been yielded yet. The call is recorded in
+    METRICS at the end of the stream, including the time until the first chunk arrived.
+    """
+    backend = get_backend()
+    cache = RESPONSE_CACHE if backend.cacheable else None
+    start = time.perf_counter()
+    if cache is not None:
+        cached = cache.get(model, prompt)
+        if cached is not None:
+            METRICS.model_call(stage, model, prompt, cached, time.perf_counter() - start, cached=True)
+            yield cached
+            return cached
+        if cache.read_only:
+            raise CacheMissError(f"No recorded response for this {model} prompt in replay mode.")
+    chunks = []
+    first_chunk_seconds = None
+    try:
+        chunk_stream = SCHEDULER.stream(
+            lambda: backend.stream(prompt, model, stage), stage,
+            tokens=estimate_tokens(prompt), response_tokens=estimate_tokens_for_length, on_retry=record_retry(stage),
+        )
+        for chunk in chunk_stream:
+            if first_chunk_seconds is None:
+                first_chunk_seconds = time.perf_counter() - start
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        METRICS.model_call(stage, model, prompt, None, time.perf_counter() - start, error=e,
+                           first_chunk_seconds=first_chunk_seconds)
+        raise
+    content = "".join(chunks)
+    METRICS.model_call(stage, model, prompt, content, time.perf_counter() - start,
+                       first_chunk_seconds=first_chunk_seconds)
+    if cache is not None:
+        cache.put(model, prompt, content)
+    return content
 
 def parse_files(text):
     """
@@ -51,44 +214,41 @@ def parse_files(text):
     <file content>
     ### end ###
     
-    Returns a dictionary mapping filenames (which may include paths) to their content.
+    Returns a dictionary mapping filenames (which may include paths) to their content,
+    with markdown code fences removed (see parsing.strip_file_fences). Malformed blocks, duplicate filenames and
+    stray text are reported instead of being silently dropped.
     """
-    pattern = r"### filename: (.*?) ###\s*(.*?)\s*### end ###"
-    matches = re.findall(pattern, text, flags=re.DOTALL)
-    result = {}
-    for filename, content in matches:
-        result[filename.strip()] = content.strip()
-    return result
+    with METRICS.timer("parse", chars=len(text)):
+        files, diagnostics = parse_file_blocks(text)
+    for diagnostic in diagnostics:
+        safe_print(f"Parse warning: {format_diagnostic(diagnostic)}")
+    return files
 
 def assemble_files(directory):
     """
     Recursively assemble the contents of all files in the given directory and its subdirectories
     into a single string in the custom format. Each file is represented with its relative path.
+    Only files that changed since the previous call are re-read (see workspace.WorkspaceSnapshot),
+    and databases, logs, caches and binary files are skipped.
     """
-    result = ""
-    for root, dirs, files in os.walk(directory):
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            relative_path = os.path.relpath(file_path, directory)
-            if os.path.isfile(file_path):
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read().strip()
-                result += f"### filename: {relative_path} ###\n{content}\n### end ###\n"
-    return result
+    return get_snapshot(directory).render()
 
 def write_files(file_dict, output_directory):
     """
     Given a dictionary mapping filenames (which may include subdirectories) to file contents,
     write each file to the output_directory, creating subdirectories as needed.
+    The files are written as one atomic batch (see atomic_writes.FileTransaction) and files
+    whose content is unchanged are skipped. Returns the list of filenames written.
     """
-    for filename, content in file_dict.items():
-        file_path = os.path.join(output_directory, filename)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+    with METRICS.timer("write", files=len(file_dict)):
+        return write_files_atomically(file_dict, output_directory)
 
 # --- New: Auditor Functions ---
 
+# Audit pool size; override in config.json with "audit_concurrency". Failed audit calls are
+# retried by SCHEDULER (see "rate_limit" in config.json), not by the audit pool.
+AUDIT_CONCURRENCY = config.get("audit_concurrency", 4)
+
 def audit_file(original_code, new_code, model="o1-mini"):
     """
     You are an expert code integrator. Your task is to merge modifications into a full,
@@ -111,35 +271,61 @@ def audit_file(original_code, new_code, model="o1-mini"):
         f"{new_code}\n"
         "----------------------\n"
     )
-    response = openai.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": audit_prompt}],
-    )
-    return response.choices[0].message.content
+    # Code fences are stripped by audited_write_files, which knows the file type.
+    return chat_completion(audit_prompt, model, stage="audit")
 
-def audited_write_files(new_file_dict, output_directory, model="o1-mini"):
+def audited_write_files(new_file_dict, output_directory, model="o1-mini", max_workers=AUDIT_CONCURRENCY):
     """
     For each file to be written, if an original version exists, call the auditor function 
     to merge the new content with the existing file to produce a complete and fully functional file.
     Then, write the audited content. This supports files in subdirectories.
+
+    Files identical to the version on disk are skipped entirely, and files that differ only in
+    whitespace are written directly without a model call.
+
+    Audits run in parallel (at most max_workers at a time). Their model calls go through
+    SCHEDULER, which retries transient errors; if a file still cannot be audited, its existing
+    version is left untouched. Once all audits are done, the new, whitespace-only and audited files are written
+    together as one atomic batch (see atomic_writes.FileTransaction), so a crash never leaves
+    a mix of old and new files behind. Returns the sorted list of filenames whose audit failed.
     """
+    audit_jobs = []
+    skipped = 0
+    merged_locally = 0
+    transaction = FileTransaction(output_directory)
     for filename, new_content in new_file_dict.items():
-        file_path = os.path.join(output_directory, filename)
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as f:
-                original_content = f.read()
-        else:
-            original_content = None
-
+        original_content = read_existing(os.path.join(output_directory, filename))
         if original_content:
-            safe_print(f"Auditing file: {filename}")
-            audited_content = audit_file(original_content, new_content, model=model)
-        else:
-            audited_content = new_content
-
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(audited_content)
+            change = classify_change(original_content, new_content, filename)
+            if change == UNCHANGED:
+                skipped += 1
+                continue
+            if change == CHANGED:
+                audit_jobs.append((filename, original_content, new_content))
+                continue
+            merged_locally += 1
+        transaction.add(filename, new_content)
+
+    def stage_audited(filename, audited_content):
+        safe_print(f"Audited file: {filename}")
+        # Fences are stripped here, in memory, so the written file never needs a cleanup pass.
+        with METRICS.timer("fence_strip", stage="audit"):
+            audited_content = strip_code_fences_from_text(audited_content, filename).strip()
+        transaction.add(filename, audited_content)
+
+    if audit_jobs:
+        safe_print(f"Auditing {len(audit_jobs)} files with up to {max_workers} workers")
+    # chat_completion retries each audit through SCHEDULER and records each retry.
+    failures = run_audits(audit_jobs, audit_file, stage_audited, model=model, max_workers=max_workers)
+    for filename, error in failures.items():
+        safe_print(f"Audit failed for {filename}, keeping the existing version: {error}")
+    with METRICS.timer("write", files=len(transaction.files)):
+        transaction.commit()
+    safe_print(
+        f"Audit summary: {len(audit_jobs) - len(failures)} audited, {len(failures)} failed, "
+        f"{skipped} unchanged and skipped, {merged_locally} whitespace-only merged locally"
+    )
+    return list(failures)
 
 # --- Helper: Load the Base Prompt from a file ---
 def load_base_prompt(prompt_file="BasePrompt.txt"):
@@ -164,13 +350,34 @@ def load_base_prompt(prompt_file="BasePrompt.txt"):
 # --- Model Call Functions (using o1-mini or o1-preview) ---
 DEFAULT_MODEL = "o1-mini"
 
-def generate_initial_code(prompt, model=DEFAULT_MODEL):
+# --- Review Stage Configuration ---
+# Each reviewer gets one of these prompts. With more reviewers than prompts, the prompts are reused in
+# order with a reviewer-specific note (see reviews.reviewer_prompt_list), so every prompt is different.
+REVIEWER_PROMPTS = [
+    "Please review the code and fix any errors or omissions, ensuring that the output is complete and ready-to-run.",
+    "Please inspect the code for bugs and inconsistencies, and return a fully integrated, corrected version that works out-of-the-box.",
+]
+# Both values can be overridden in config.json with "num_reviewers" and "review_concurrency".
+NUM_REVIEWERS = config.get("num_reviewers", len(REVIEWER_PROMPTS))
+REVIEW_CONCURRENCY = config.get("review_concurrency", NUM_REVIEWERS)
+
+# "diff" merges reviewer changes locally and only sends conflicting files to the model;
+# "full" sends the original and every review in full. Override with "aggregation_mode".
+AGGREGATION_MODE = config.get("aggregation_mode", "diff")
+
+# Approximate number of tokens of code pasted into a single prompt. The most relevant files
+# are included in full and the rest are only listed. Override with "context_token_budget".
+CONTEXT_TOKEN_BUDGET = config.get("context_token_budget", 60000)
+
+# Stream the initial generation and stage each file on disk as soon as it is complete.
+# Override in config.json with "stream_generation".
+STREAM_GENERATION = config.get("stream_generation", True)
+
+def generation_prompt(prompt):
     """
-    Generate complete, working code based on the given prompt.
-    The output must follow the specified format: each file is preceded by a header line and followed by a footer line.
-    Do not include any extra commentary or placeholder text.
+    Append the output format instructions to the code generation prompt.
     """
-    full_prompt = (
+    return (
         prompt + "\n\n"
         "Return your output in the following format:\n"
         "For each file, output a header line as:\n"
@@ -179,11 +386,43 @@ def generate_initial_code(prompt, model=DEFAULT_MODEL):
         "### end ###\n"
         "Ensure the code is fully complete, self-contained, and ready-to-run. Do not include any commentary."
     )
-    response = openai.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": full_prompt}],
-    )
-    return response.choices[0].message.content
+
+def generate_initial_code(prompt, model=DEFAULT_MODEL):
+    """
+    Generate complete, working code based on the given prompt.
+    The output must follow the specified format: each file is preceded by a header line and followed by a footer line.
+    Do not include any extra commentary or placeholder text.
+    """
+    return chat_completion(generation_prompt(prompt), model, stage="generate")
+
+def generate_initial_code_stream(prompt, model=DEFAULT_MODEL):
+    """
+    Same as generate_initial_code, but yield the output in chunks as the model produces it.
+    """
+    return chat_completion_stream(generation_prompt(prompt), model, stage="generate")
+
+def stream_and_stage_files(chunks, transaction):
+    """
+    Parse streamed model output (a chat_completion_stream generator) and stage each file in
+    transaction (see atomic_writes.FileTransaction.stage) as soon as its footer arrives, so
+    the files are on disk, ready to be committed, when the stream ends. Files that are
+    already up to date are skipped. Returns the complete output text, which later stages
+    still need.
+    """
+    parser = StreamingFileParser()
+    while True:
+        try:
+            chunk = next(chunks)
+        except StopIteration as end:
+            output = end.value
+            break
+        for filename, content in parser.feed(chunk):
+            transaction.stage(filename, content)
+    for filename, content in parser.close():
+        transaction.stage(filename, content)
+    for diagnostic in parser.diagnostics:
+        safe_print(f"Parse warning: {format_diagnostic(diagnostic)}")
+    return output
 
 def load_feedback(feedback_path="feedback.txt"):
     """
@@ -202,11 +441,12 @@ def clear_feedback(feedback_path="feedback.txt"):
         with open(feedback_path, "w", encoding="utf-8") as f:
             f.write("")
 
-def review_code(code, reviewer_prompt, model=DEFAULT_MODEL):
+def review_code(code, reviewer_prompt, model=DEFAULT_MODEL, reviewer=None):
     """
     Review the provided code and produce a corrected, fully integrated version.
     Your output must contain the complete code for each file, with no partial updates or placeholder text.
     Do not include any commentary.
+    reviewer (the reviewer's index) keeps each reviewer's cached response separate.
     """
     full_prompt = (
         reviewer_prompt + "\n\n"
@@ -217,36 +457,95 @@ def review_code(code, reviewer_prompt, model=DEFAULT_MODEL):
         "Here is the code:\n" + code + "\n\n"
         "Ensure the final output is complete and working."
     )
-    response = openai.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": full_prompt}],
-    )
-    return response.choices[0].message.content
+    variant = f"reviewer {reviewer}" if reviewer is not None else None
+    return chat_completion(full_prompt, model, stage="review", cache_variant=variant)
 
-def aggregate_reviews(original_code, review1, review2, model=DEFAULT_MODEL):
+def aggregate_reviews(original_code, reviews, model=DEFAULT_MODEL, budget_tokens=None):
     """
-    Compare the original code and two revised versions provided by independent reviewers.
+    Compare the original code and the revised versions provided by independent reviewers.
     Merge the best improvements into a final, complete version of each file.
     Ensure that the final output is fully working and contains no placeholder text.
     Return the merged code in the same file format without any commentary.
+
+    If budget_tokens is given, it is split evenly between the original and each review, and
+    files that a reviewer changed are the first to be included in full.
     """
+    if budget_tokens is not None:
+        original_files, _ = parse_file_blocks(original_code, strip_fences=False)
+        changed = set()
+        for review in reviews:
+            review_files, _ = parse_file_blocks(review, strip_fences=False)
+            changed.update(
+                path for path, content in review_files.items() if original_files.get(path) != content
+            )
+        share = budget_tokens // (len(reviews) + 1)
+        original_code, report = pack_code_text(original_code, share, changed, stage="aggregate: original")
+        safe_print(format_report(report))
+        packed_reviews = []
+        for i, review in enumerate(reviews, start=1):
+            packed_review, report = pack_code_text(review, share, changed, stage=f"aggregate: reviewer {i}")
+            safe_print(format_report(report))
+            packed_reviews.append(packed_review)
+        reviews = packed_reviews
+
+    reviewed_sections = "".join(
+        f"\n\nReviewer {i} Revised Code:\n" + review for i, review in enumerate(reviews, start=1)
+    )
     aggregator_prompt = (
-        "You are to merge two reviewed versions of code with the original version. "
+        f"You are to merge {len(reviews)} reviewed versions of code with the original version. "
         "Compare the changes, and integrate the best improvements into complete, self-contained files that are ready-to-run. "
         "Do not output any placeholder text or commentary. Every file must be provided in full.\n\n"
         "Original Code:\n" + original_code +
-        "\n\nReviewer 1 Revised Code:\n" + review1 +
-        "\n\nReviewer 2 Revised Code:\n" + review2 +
+        reviewed_sections +
         "\n\nReturn the final merged version in the format:\n"
         "### filename: <filename> ###\n"
         "<complete file content>\n"
         "### end ###"
     )
-    response = openai.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": aggregator_prompt}],
+    return chat_completion(aggregator_prompt, model, stage="aggregate")
+
+def aggregate_reviews_by_diff(original_code, reviews, model=DEFAULT_MODEL):
+    """
+    Aggregate reviews with a local three-way merge and only ask the model about conflicts.
+    Files the reviewers left alone, changed identically, or changed in non-overlapping places
+    are merged locally (see merging.merge_reviews). For files where the reviewers' changes
+    overlap, the model gets the original file and each reviewer's unified diff instead of
+    full copies of the codebase. If there are no conflicts, no model call is made.
+    Returns the merged code in the custom file format.
+    """
+    with METRICS.timer("merge", stage="aggregate"):
+        merged_files, conflicts, stats = merge_reviews(original_code, reviews)
+    safe_print(
+        f"Diff aggregation: {stats['unchanged']} unchanged, {stats['single']} taken from one reviewer, "
+        f"{stats['merged']} merged locally, {stats['conflict']} conflicting"
     )
-    return response.choices[0].message.content
+
+    if conflicts:
+        sections = []
+        for path, (original, versions) in conflicts.items():
+            diffs = "".join(
+                f"\nReviewer {i} changes:\n{unified_diff(path, original, version) or '(no changes)'}\n"
+                for i, version in enumerate(versions, start=1)
+            )
+            sections.append(f"Original version:\n{render_file(path, original)}{diffs}")
+        conflict_prompt = (
+            f"You are to merge the changes that {len(reviews)} reviewers made to the files below. "
+            "For each file you are given the original content and each reviewer's changes as a unified diff. "
+            "Integrate the best improvements into complete, self-contained files that are ready-to-run. "
+            "Do not output any placeholder text or commentary. Every file must be provided in full.\n\n"
+            + "\n".join(sections) +
+            "\n\nReturn the final merged version of each file above in the format:\n"
+            "### filename: <filename> ###\n"
+            "<complete file content>\n"
+            "### end ###"
+        )
+        safe_print(f"Context [aggregate: conflicts]: ~{estimate_tokens(conflict_prompt)} tokens sent")
+        resolved = parse_files(chat_completion(conflict_prompt, model, stage="aggregate"))
+        for path, (original, versions) in conflicts.items():
+            # Keep the first reviewer's version if the model did not return the file.
+            merged_files[path] = resolved.get(path, next(v for v in versions if v != original))
+
+    return "".join(render_file(path, content) for path, content in merged_files.items())
 
 def gap_analysis(code_text, model=DEFAULT_MODEL):
     """
@@ -262,33 +561,161 @@ def gap_analysis(code_text, model=DEFAULT_MODEL):
         "Provide only the necessary suggestions in plain text.\n\n"
         + code_text
     )
-    response = openai.chat.completions.create(
-        model=model,
-        messages=[{"role": "user", "content": analysis_prompt}],
-    )
-    return response.choices[0].message.content
+    return chat_completion(analysis_prompt, model, stage="gap_analysis")
 
-# --- MAIN ORCHESTRATION (All intermediate data kept in memory) ---
+# --- MAIN ORCHESTRATION (Checkpointed pipeline of named stages) ---
 
 # Final website files will be written to the 'todo_app' directory.
 DIR = "todo_app"
-os.makedirs(DIR, exist_ok=True)
-
-# Load the base prompt from BasePrompt.txt
-base_prompt = load_base_prompt("BasePrompt.txt")
+# One compressed checkpoint per iteration is written here after every stage.
+CHECKPOINT_DIR = "json_outputs"
+MAX_ITERATIONS = 5
+
+# The stages of one iteration and the stages each one depends on. Each stage reads and
+# updates the iteration state. Stages whose dependencies are done run concurrently: the
+# reviews start while write_initial is still writing (or, when streaming, committing) the
+# initial files, and the audit writes overlap with the post-run gap analysis.
+STAGES = {
+    "generate": [],
+    "write_initial": ["generate"],
+    "review": ["generate"],
+    "aggregate": ["review"],
+    "audit": ["aggregate", "write_initial"],
+    "gap_analysis": ["aggregate"],
+}
+# The loop stops once the size-weighted share of changed code tokens (ASTs for Python) is below
+# CONVERGENCE_CODE_THRESHOLD and the gap-analysis suggestions changed less than
+# CONVERGENCE_SUGGESTION_THRESHOLD. Override with "convergence_code_threshold" and
+# "convergence_suggestion_threshold".
+CONVERGENCE_CODE_THRESHOLD = config.get("convergence_code_threshold", 0.02)
+CONVERGENCE_SUGGESTION_THRESHOLD = config.get("convergence_suggestion_threshold", 0.6)
+# Maximum number of stages running at the same time; override with "stage_concurrency".
+STAGE_CONCURRENCY = config.get("stage_concurrency", 3)
+
+class Pipeline:
+    """
+    The generate -> review -> aggregate -> audit / gap-analysis loop for one application.
+    Each iteration runs the STAGES dependency graph (see stage_graph.StageGraph) and prints
+    a trace of stage start and end times with the critical path marked.
+    After each stage the iteration state is checkpointed (see checkpoints.CheckpointStore),
+    so run(resume=True) continues from the last completed stages after a crash.
+    """
 
-max_iterations = 5
-iteration = 0
-previous_aggregated_code = ""
+    def __init__(self, output_dir=DIR, prompt_file="BasePrompt.txt", feedback_path="feedback.txt",
+                 checkpoint_dir=CHECKPOINT_DIR, max_iterations=MAX_ITERATIONS):
+        self.output_dir = output_dir
+        self.prompt_file = prompt_file
+        self.feedback_path = feedback_path
+        self.max_iterations = max_iterations
+        self.checkpoints = CheckpointStore(checkpoint_dir)
+        # Per-iteration convergence metrics, one JSON object per line.
+        self.convergence_log = os.path.join(checkpoint_dir, "convergence.jsonl")
+        # Per-call and local-work metrics (see metrics.MetricsRecorder), one JSON object per line.
+        self.metrics_log = os.path.join(checkpoint_dir, "metrics.jsonl")
+        # Deduplicated copy of the output directory after every iteration (see history.py).
+        self.history = HistoryStore(os.path.join(checkpoint_dir, "history"))
+        # Files staged by a streamed generate stage, until write_initial commits them.
+        self.initial_transaction = None
+        self.stage_functions = {
+            "generate": self.stage_generate,
+            "write_initial": self.stage_write_initial,
+            "review": self.stage_review,
+            "aggregate": self.stage_aggregate,
+            "audit": self.stage_audit,
+            "gap_analysis": self.stage_gap_analysis,
+        }
+
+    def new_state(self, iteration, base_prompt, previous_aggregated_code, previous_post_analysis=""):
+        return {
+            "iteration": iteration,
+            "completed_stages": [],
+            "base_prompt": base_prompt,
+            "previous_aggregated_code": previous_aggregated_code,
+            "previous_post_analysis": previous_post_analysis,
+        }
+
+    def run(self, resume=False):
+        """
+        Run iterations until the aggregated code converges (see convergence.measure_convergence)
+        or max_iterations is reached.
+        With resume=True, continue from the latest checkpoint instead of starting over.
+        Returns the number of the last iteration run.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        iteration, state = (self.checkpoints.latest() if resume else (None, None))
+        if state is None:
+            if resume:
+                safe_print("No checkpoint found. Starting a new run.")
+            self.checkpoints.clear()
+            if os.path.exists(self.convergence_log):
+                os.remove(self.convergence_log)
+            METRICS.start(self.metrics_log)
+            iteration = 0
+            state = self.new_state(0, load_base_prompt(self.prompt_file), "")
+        else:
+            safe_print(f"Resuming iteration {iteration+1} after stages: {', '.join(state['completed_stages']) or 'none'}")
+            METRICS.start(self.metrics_log, reset=False)
+
+        while iteration < self.max_iterations:
+            if not state["completed_stages"]:
+                safe_print(f"\n===== Iteration {iteration+1} =====\n")
+            self.run_stages(iteration, state)
+
+            if state["converged"]:
+                safe_print("Aggregated code and suggestions have converged. Terminating loop.")
+                break
+            iteration += 1
+            state = self.new_state(
+                iteration, state["next_base_prompt"], state["aggregated_code_output"], state["post_analysis"]
+            )
 
-while iteration < max_iterations:
-    safe_print(f"\n===== Iteration {iteration+1} =====\n")
-    
-    if iteration == 0:
-        # --- Pre-run Gap Analysis & Prompt Update ---
-        if os.listdir(DIR):
+        safe_print(f"\nAll iterations complete. Application files are in '{self.output_dir}'.")
+        safe_print(f"Metrics per stage (details in {self.metrics_log}):")
+        safe_print(format_summary(METRICS.summary(CURRENT_JOB.get())))
+        return min(iteration + 1, self.max_iterations)
+
+    def run_stages(self, iteration, state):
+        """Run the stages of one iteration that are not completed yet, checkpointing after each."""
+        graph = StageGraph()
+        for stage, deps in STAGES.items():
+            graph.add(stage, lambda stage=stage: self.run_stage(stage, state), deps)
+
+        def checkpoint(stage):
+            state["completed_stages"] = state["completed_stages"] + [stage]
+            # Save a copy: stages that are still running may add keys to the state.
+            self.checkpoints.save(iteration, dict(state))
+
+        try:
+            trace = graph.run(state["completed_stages"], max_workers=STAGE_CONCURRENCY, on_complete=checkpoint)
+        finally:
+            # If a stage failed before write_initial, the staged files are not needed any more:
+            # a resumed run writes them from the checkpointed output.
+            if self.initial_transaction is not None:
+                self.initial_transaction.discard()
+                self.initial_transaction = None
+        state["trace"] = state.get("trace", []) + trace
+        self.checkpoints.save(iteration, dict(state))
+        safe_print(f"Stage trace for iteration {iteration+1} (* = critical path):")
+        safe_print(format_trace(trace, graph.deps))
+
+    def run_stage(self, stage, state):
+        # Local work timed without an explicit stage (parsing, writing) is attributed to this one.
+        token = CURRENT_STAGE.set(stage)
+        try:
+            self.stage_functions[stage](state)
+        finally:
+            CURRENT_STAGE.reset(token)
+
+    def stage_generate(self, state):
+        base_prompt = state["base_prompt"]
+        if state["iteration"] == 0 and os.listdir(self.output_dir):
+            # --- Pre-run Gap Analysis & Prompt Update ---
             safe_print("Scanning current application files for pre-run gap analysis...")
-            current_files_str = assemble_files(DIR)
+            current_files_str, report = pack_files(
+                get_snapshot(self.output_dir).files(), CONTEXT_TOKEN_BUDGET,
+                feedback=load_feedback(self.feedback_path), stage="pre-run gap analysis"
+            )
+            safe_print(format_report(report))
             pre_analysis = gap_analysis(current_files_str)
             safe_print("Pre-run Gap Analysis suggestions:")
             safe_print(pre_analysis)
@@ -299,64 +726,153 @@ while iteration < max_iterations:
             )
         else:
             updated_prompt = base_prompt
-    else:
-        updated_prompt = base_prompt
-
-    safe_print("Updated prompt for code generation:")
-    safe_print(updated_prompt)
-
-    additional_feedback = load_feedback()
-    if additional_feedback:
-        safe_print("Additional feedback loaded")
-        updated_prompt += "\n\nAdditional Very Important Feedback to fix first:\n" + additional_feedback
-    clear_feedback()
-
-    # --- Step 1: Initial Code Generation ---
-    safe_print("Initial Code Generation Begins")
-    initial_code_output = generate_initial_code(updated_prompt)
-    initial_files = parse_files(initial_code_output)
-    # For the initial generation, simply write the files.
-    write_files(initial_files, DIR)
-    remove_triple_backtick_lines(DIR)
-    safe_print("Initial Code Generation Ends")
-
-    # --- Step 2: Reviews ---
-    safe_print("Review Begins")
-    review1_output = review_code(initial_code_output, "Please review the code and fix any errors or omissions, ensuring that the output is complete and ready-to-run.")
-    safe_print("Reviewer 1 complete")
-
-    review2_output = review_code(initial_code_output, "Please inspect the code for bugs and inconsistencies, and return a fully integrated, corrected version that works out-of-the-box.")
-    safe_print("Reviewer 2 complete")
-
-    # --- Step 3: Aggregation ---
-    safe_print("Aggregation Begins")
-    aggregated_code_output = aggregate_reviews(initial_code_output, review1_output, review2_output)
-    aggregated_files = parse_files(aggregated_code_output)
-    # Use the auditor to check each file (supporting subdirectories)
-    audited_write_files(aggregated_files, DIR, model=DEFAULT_MODEL)
-    remove_triple_backtick_lines(DIR)
-    safe_print("Aggregation Ends")
-
-    # --- Step 4: Post-run Gap Analysis ---
-    safe_print("Post-run Gap Analysis Begins")
-    post_analysis = gap_analysis(aggregated_code_output)
-    safe_print("Post-run Gap Analysis suggestions:")
-    safe_print(post_analysis)
-
-    # --- Update Base Prompt with Latest Analysis ---
-    base_prompt = (
-        load_base_prompt("BasePrompt.txt") +  # Reload the base prompt in case it has changed
-        "\n\nIncorporate all of the following improvements:\n" + post_analysis
-    )
-    safe_print("Base prompt updated for next iteration:")
-    safe_print(base_prompt)
 
-    if aggregated_code_output.strip() == previous_aggregated_code.strip():
-        safe_print("No changes detected in aggregated code. Terminating loop.")
-        break
-    else:
-        previous_aggregated_code = aggregated_code_output
+        safe_print("Updated prompt for code generation:")
+        safe_print(updated_prompt)
+
+        additional_feedback = load_feedback(self.feedback_path)
+        if additional_feedback:
+            safe_print("Additional feedback loaded")
+            updated_prompt += "\n\nAdditional Very Important Feedback to fix first:\n" + additional_feedback
+        clear_feedback(self.feedback_path)
+        state["updated_prompt"] = updated_prompt
+
+        # --- Step 1: Initial Code Generation ---
+        safe_print("Initial Code Generation Begins")
+        if STREAM_GENERATION:
+            # The files are staged while the output arrives; write_initial commits them
+            # while the reviews are already running.
+            transaction = FileTransaction(self.output_dir)
+            try:
+                state["initial_code_output"] = stream_and_stage_files(
+                    generate_initial_code_stream(updated_prompt), transaction
+                )
+            except BaseException:
+                transaction.discard()
+                raise
+            self.initial_transaction = transaction
+        else:
+            state["initial_code_output"] = generate_initial_code(updated_prompt)
+        safe_print("Initial Code Generation Ends")
+
+    def stage_write_initial(self, state):
+        # For the initial generation, simply write the files: commit the ones staged while
+        # streaming, or parse the output (also after resuming, when nothing is staged).
+        transaction, self.initial_transaction = self.initial_transaction, None
+        if transaction is None:
+            write_files(parse_files(state["initial_code_output"]), self.output_dir)
+            return
+        with METRICS.timer("write", files=len(transaction.live)):
+            written = transaction.commit()
+        for filename in written:
+            safe_print(f"Wrote {filename}")
+
+    def stage_review(self, state):
+        # --- Step 2: Reviews (all reviewers run concurrently) ---
+        safe_print("Review Begins")
+        state["review_outputs"] = run_reviews(
+            state["initial_code_output"],
+            reviewer_prompt_list(REVIEWER_PROMPTS, NUM_REVIEWERS),
+            review_code,
+            max_workers=REVIEW_CONCURRENCY,
+        )
+        safe_print(f"{len(state['review_outputs'])} reviewers complete")
+
+    def stage_aggregate(self, state):
+        # --- Step 3: Aggregation ---
+        safe_print("Aggregation Begins")
+        if AGGREGATION_MODE == "diff":
+            state["aggregated_code_output"] = aggregate_reviews_by_diff(
+                state["initial_code_output"], state["review_outputs"]
+            )
+        else:
+            state["aggregated_code_output"] = aggregate_reviews(
+                state["initial_code_output"], state["review_outputs"], budget_tokens=CONTEXT_TOKEN_BUDGET
+            )
 
-    iteration += 1
+    def stage_audit(self, state):
+        # Use the auditor to check each file (supporting subdirectories)
+        aggregated_files = parse_files(state["aggregated_code_output"])
+        audited_write_files(aggregated_files, self.output_dir, model=DEFAULT_MODEL)
+        safe_print("Aggregation Ends")
+        state["history_version"] = self.history.snapshot(self.output_dir, {"iteration": state["iteration"] + 1})
+        safe_print(f"Saved the files of iteration {state['iteration'] + 1} as version {state['history_version']} in {self.history.directory}")
+
+    def stage_gap_analysis(self, state):
+        # --- Step 4: Post-run Gap Analysis ---
+        safe_print("Post-run Gap Analysis Begins")
+        aggregated_code_output = state["aggregated_code_output"]
+        initial_files, _ = parse_file_blocks(state["initial_code_output"])
+        aggregated_files, _ = parse_file_blocks(aggregated_code_output)
+        packed_output, report = pack_code_text(
+            aggregated_code_output, CONTEXT_TOKEN_BUDGET,
+            changed=[path for path, content in aggregated_files.items() if initial_files.get(path) != content],
+            stage="post-run gap analysis"
+        )
+        safe_print(format_report(report))
+        post_analysis = gap_analysis(packed_output)
+        safe_print("Post-run Gap Analysis suggestions:")
+        safe_print(post_analysis)
+        state["post_analysis"] = post_analysis
+
+        # --- Update Base Prompt with Latest Analysis ---
+        state["next_base_prompt"] = (
+            load_base_prompt(self.prompt_file) +  # Reload the base prompt in case it has changed
+            "\n\nIncorporate all of the following improvements:\n" + post_analysis
+        )
+        safe_print("Base prompt updated for next iteration:")
+        safe_print(state["next_base_prompt"])
+
+        # --- Convergence: stop once the code and the suggestions barely change ---
+        previous_files, _ = parse_file_blocks(state["previous_aggregated_code"])
+        metrics = measure_convergence(
+            state["iteration"] + 1, previous_files, aggregated_files,
+            state.get("previous_post_analysis", ""), post_analysis,
+            code_threshold=CONVERGENCE_CODE_THRESHOLD, suggestion_threshold=CONVERGENCE_SUGGESTION_THRESHOLD,
+        )
+        record_metrics(metrics, self.convergence_log)
+        safe_print(
+            f"Convergence: code changed {metrics['code_delta']:.1%} across {len(metrics['files_changed'])} files, "
+            f"suggestions changed {metrics['suggestion_delta']:.1%}"
+        )
+        state["convergence"] = metrics
+        state["converged"] = metrics["converged"]
+
+def print_cache_stats():
+    if RESPONSE_CACHE is not None:
+        cache_stats = RESPONSE_CACHE.stats()
+        safe_print(
+            f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['entries']} entries ({cache_stats['bytes']} bytes) stored"
+        )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate an application with iterative model review.")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from the last completed stage of the latest checkpoint")
+    parser.add_argument("--output-dir", default=DIR, help="directory the application files are written to")
+    parser.add_argument("--prompt-file", default="BasePrompt.txt", help="file with the base prompt")
+    parser.add_argument("--feedback-file", default="feedback.txt", help="file with additional feedback")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="directory for per-iteration checkpoints")
+    parser.add_argument("--max-iterations", type=int, default=MAX_ITERATIONS)
+    parser.add_argument("--backend", choices=["openai", "stub", "record", "replay"],
+                        help="model backend to use instead of the one in config.json")
+    add_cache_arguments(parser)
+    args = parser.parse_args(argv)
+
+    configure_response_cache(args)
+    if args.backend:
+        set_backend(make_backend(dict(config.get("backend", {}), type=args.backend), api_key=config.get("api_key")))
+
+    pipeline = Pipeline(
+        output_dir=args.output_dir,
+        prompt_file=args.prompt_file,
+        feedback_path=args.feedback_file,
+        checkpoint_dir=args.checkpoint_dir,
+        max_iterations=args.max_iterations,
+    )
+    pipeline.run(resume=args.resume)
+    print_cache_stats()
 
-safe_print(f"\nAll iterations complete. Application files are in '{DIR}'.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import os
+from collections import namedtuple
+
+HEADER_PREFIX = "### filename: "
+HEADER_SUFFIX = " ###"
+END_MARKER = "### end ###"
+FENCE = "```"
+
+# File types whose code fence lines are all removed, while parsing and by the standalone fence
+# cleaner. In other files (e.g. a README.md) fences can be real content, so only a fence pair
+# wrapping the whole file is removed (see strip_file_fences).
+CLEANABLE_EXTENSIONS = ('.html', '.js', '.css', '.py', '.txt', '.log')
+
+# A problem found while parsing. kind is one of UNTERMINATED, DUPLICATE or STRAY_TEXT;
+# line is the 1-based line number in the parsed text where it was found.
+Diagnostic = namedtuple("Diagnostic", ["kind", "line", "filename", "message"])
+UNTERMINATED = "unterminated"
+DUPLICATE = "duplicate"
+STRAY_TEXT = "stray_text"
+
+def split_header(line):
+    """
+    If the line starts with a file header ("### filename: <filename> ###"), return the
+    filename and the text after the header on the same line. Otherwise return (None, None).
+    As with the original regex parser, the filename ends at the first " ###".
+    """
+    stripped = line.lstrip()
+    if not stripped.startswith(HEADER_PREFIX):
+        return None, None
+    end = stripped.find(HEADER_SUFFIX, len(HEADER_PREFIX))
+    if end < 0:
+        return None, None
+    return stripped[len(HEADER_PREFIX):end].strip(), stripped[end + len(HEADER_SUFFIX):]
+
+def is_fence_line(line):
+    """Return True for a markdown code fence line such as ``` or ```python."""
+    return line.lstrip().startswith(FENCE)
+
+def strip_code_fences(lines):
+    """
+    Remove markdown code fence lines (``` or ```lang) from a list of content lines.
+    Lines that merely contain ``` somewhere else (for example inside a string) are kept.
+    """
+    return [line for line in lines if not is_fence_line(line)]
+
+def strip_wrapping_fence(lines):
+    """
+    Remove an opening fence on the first non-blank line together with a closing fence on the
+    last one, i.e. a fence the model wrapped around the whole file. Fences inside are kept.
+    """
+    filled = [index for index, line in enumerate(lines) if line.strip()]
+    if len(filled) >= 2 and is_fence_line(lines[filled[0]]) and lines[filled[-1]].strip() == FENCE:
+        return lines[filled[0] + 1:filled[-1]]
+    return lines
+
+def strip_file_fences(filename, lines):
+    """
+    Remove code fences from the content lines of a file: every fence line for the
+    CLEANABLE_EXTENSIONS, only a fence wrapping the whole file for other files.
+    """
+    if filename.lower().endswith(CLEANABLE_EXTENSIONS):
+        return strip_code_fences(lines)
+    return strip_wrapping_fence(lines)
+
+def strip_code_fences_from_text(text, filename=None):
+    """
+    Remove markdown code fences from a whole file's text: as strip_file_fences does for
+    the given filename, or every fence line if no filename is given.
+    """
+    lines = text.split("\n")
+    return "\n".join(strip_file_fences(filename, lines) if filename is not None else strip_code_fences(lines))
+
+class StreamingFileParser:
+    """
+    Incremental, single-pass parser for the custom file format:
+
+    ### filename: <filename> ###
+    <file content>
+    ### end ###
+
+    Feed it chunks of model output as they arrive; every call to feed() returns the
+    (filename, content) pairs whose footer arrived in that chunk. Each line is looked at
+    once, so parsing is linear in the size of the output, and only the current partial
+    line and the lines of the file being read are held in memory.
+
+    As with the original regex parser, a footer also closes a block when it follows other text
+    on the same line ("x = 1 ### end ###"); text after it on that line is parsed as a new line.
+    Likewise, text after a header on the same line ("### filename: a.txt ### x = 1") is the
+    first line of the file.
+
+    Problems are collected in self.diagnostics instead of being silently ignored:
+    a block with no footer (dropped), a filename that appears twice (the later block wins),
+    and non-blank text outside any block (ignored). A header inside an open block is taken
+    to mean the open block is missing its footer, so the new block is still parsed.
+
+    With strip_fences=True, markdown code fences are removed from file contents
+    (see strip_file_fences).
+    """
+
+    def __init__(self, strip_fences=True):
+        self.strip_fences = strip_fences
+        self.diagnostics = []
+        self._seen = set()
+        self._partial = []
+        self._line_number = 0
+        self._filename = None
+        self._header_line = 0
+        self._lines = []
+
+    def feed(self, chunk):
+        """Consume a chunk of text and return the list of files completed by it."""
+        completed = []
+        self._partial.append(chunk)
+        if "\n" not in chunk:
+            return completed
+        lines = "".join(self._partial).split("\n")
+        self._partial = [lines.pop()]
+        for line in lines:
+            self._consume_line(line, completed)
+        return completed
+
+    def close(self):
+        """Flush the final partial line and return any files completed by it."""
+        completed = []
+        remainder = "".join(self._partial)
+        self._partial = []
+        if remainder:
+            self._consume_line(remainder, completed)
+        if self._filename is not None:
+            self._report_unterminated()
+        self._filename = None
+        self._lines = []
+        return completed
+
+    def _consume_line(self, line, completed):
+        self._line_number += 1
+        self._parse_line(line, completed)
+
+    def _parse_line(self, line, completed):
+        filename, remainder = split_header(line)
+        if filename is not None:
+            if self._filename is not None:
+                self._report_unterminated()
+            self._filename = filename
+            self._header_line = self._line_number
+            self._lines = []
+            if remainder.strip():
+                self._parse_line(remainder, completed)
+            return
+        if self._filename is None:
+            if line.strip():
+                self.diagnostics.append(Diagnostic(
+                    STRAY_TEXT, self._line_number, None, "Text outside of any file block was ignored."
+                ))
+            return
+        end = line.find(END_MARKER)
+        if end >= 0:
+            if line[:end].strip():
+                self._lines.append(line[:end])
+            completed.append(self._finish_block())
+            remainder = line[end + len(END_MARKER):]
+            if remainder.strip():
+                self._parse_line(remainder, completed)
+            return
+        self._lines.append(line)
+
+    def _finish_block(self):
+        filename = self._filename
+        lines = strip_file_fences(filename, self._lines) if self.strip_fences else self._lines
+        if filename in self._seen:
+            self.diagnostics.append(Diagnostic(
+                DUPLICATE, self._header_line, filename,
+                f"{filename} appears more than once; the later block replaces the earlier one."
+            ))
+        self._seen.add(filename)
+        self._filename = None
+        self._lines = []
+        return filename, "\n".join(lines).strip()
+
+    def _report_unterminated(self):
+        self.diagnostics.append(Diagnostic(
+            UNTERMINATED, self._header_line, self._filename,
+            f"{self._filename} has no '{END_MARKER}' footer and was dropped."
+        ))
+
+def parse_file_blocks(text, strip_fences=True):
+    """
+    Parse a complete model response in one pass.
+    Returns (files, diagnostics): a dictionary mapping filenames to their content and
+    the list of Diagnostic entries found while parsing.
+    """
+    parser = StreamingFileParser(strip_fences=strip_fences)
+    files = dict(parser.feed(text))
+    files.update(parser.close())
+    return files, parser.diagnostics
+
+def format_diagnostic(diagnostic):
+    """Return a one-line, human-readable description of a Diagnostic."""
+    return f"line {diagnostic.line}: {diagnostic.kind}: {diagnostic.message}"
+
+def remove_triple_backtick_lines(directory, filenames=None):
+    """
+    Standalone fence cleaner for files already on disk.
+    Remove markdown code fence lines from the given files (paths relative to directory),
+    or, if filenames is None, from every .html, .js, .css, .py, .txt or .log file under directory.
+    A file is only rewritten if its content actually changes.
+    Returns the list of files that were rewritten.
+
+    The orchestrator does not need this: fences are stripped in memory while parsing.
+    """
+    if filenames is None:
+        filenames = []
+        for root, dirs, files in os.walk(directory):
+            for filename in files:
+                if filename.endswith(CLEANABLE_EXTENSIONS):
+                    filenames.append(os.path.relpath(os.path.join(root, filename), directory))
+
+    rewritten = []
+    for filename in filenames:
+        file_path = os.path.join(directory, filename)
+        if not os.path.isfile(file_path):
+            continue
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            lines = f.readlines()
+        filtered_lines = strip_code_fences(lines)
+        if len(filtered_lines) == len(lines):
+            continue
+        with open(file_path, 'w', encoding='utf-8', newline='') as f:
+            f.writelines(filtered_lines)
+        rewritten.append(filename)
+    return rewritten
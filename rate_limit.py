@@ -0,0 +1,216 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+# Lower numbers are sent first when calls are waiting for capacity. Audits block file
+# writes, so they go ahead of everything else; the gap analysis is needed last.
+STAGE_PRIORITIES = {
+    "audit": 0,
+    "aggregate": 1,
+    "generate": 2,
+    "review": 2,
+    "gap_analysis": 3,
+}
+DEFAULT_PRIORITY = 2
+
+# Exception class names (from the openai package and the standard library) worth retrying.
+RETRYABLE_ERRORS = {
+    "RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+    "TimeoutError", "ConnectionError", "ConnectionResetError", "RemoteDisconnected",
+}
+
+class TokenBucket:
+    """
+    Allows `rate_per_minute` units per minute on average, in bursts of at most `capacity`
+    units (one minute's worth by default). take() may drive the level below zero, e.g. when a
+    response turns out to use more tokens than estimated; later callers then wait longer.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Return the seconds until `amount` units are available (0 if they are available now)."""
+        self._refill()
+        # A single request larger than the bucket only has to wait for a full bucket.
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+def status_code(error):
+    """Return the HTTP status code carried by an exception, if any."""
+    for attribute in ("status_code", "code", "status"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+def is_retryable(error):
+    """Rate limits (429), server errors (5xx), timeouts and dropped connections are retried."""
+    code = status_code(error)
+    if code is not None:
+        return code == 429 or code >= 500
+    return type(error).__name__ in RETRYABLE_ERRORS or isinstance(error, (TimeoutError, ConnectionError))
+
+def retry_after(error):
+    """Return the delay in seconds a server asked for with a Retry-After header, or None."""
+    headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+class RequestScheduler:
+    """
+    Client-side scheduler shared by every model call.
+
+    Each call first waits for admission: a place among at most max_concurrent calls in flight,
+    a request from the requests-per-minute bucket and its estimated prompt tokens from the
+    tokens-per-minute bucket (any limit left at None is not enforced). Waiting calls are
+    admitted in priority order (see STAGE_PRIORITIES), first come first served within a priority.
+
+    Calls that fail with a retryable error (see is_retryable) are retried up to max_retries
+    times after a jittered exponential backoff ("full jitter": a random delay between 0 and
+    backoff * 2**attempt seconds, capped at max_backoff), or after the server's Retry-After delay.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, max_concurrent=None,
+                 max_retries=4, backoff=1.0, max_backoff=30.0, priorities=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.priorities = dict(STAGE_PRIORITIES, **(priorities or {}))
+        self.in_flight = 0
+        self._waiting = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+
+    def set_max_concurrent(self, max_concurrent):
+        """Change the cap on calls in flight (None for no cap), e.g. for a batch of pipelines."""
+        with self._condition:
+            self.max_concurrent = max_concurrent
+            self._condition.notify_all()
+
+    def priority(self, stage):
+        return self.priorities.get(stage, DEFAULT_PRIORITY)
+
+    def _wait_time(self, tokens):
+        if self.max_concurrent is not None and self.in_flight >= self.max_concurrent:
+            return None  # Wait until a call in flight finishes.
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    def acquire(self, stage=None, tokens=0):
+        """Block until a call of this stage may be sent. Every acquire() needs a release()."""
+        entry = (self.priority(stage), next(self._order))
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            while True:
+                wait = self._wait_time(tokens) if self._waiting[0] == entry else None
+                if wait == 0.0:
+                    break
+                self._condition.wait(timeout=wait)
+            heapq.heappop(self._waiting)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+            self.in_flight += 1
+            self._condition.notify_all()
+
+    def release(self, extra_tokens=0):
+        """
+        Mark a call as finished. extra_tokens (e.g. the completion tokens of the response)
+        are charged to the tokens-per-minute bucket.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if self.tokens is not None and extra_tokens:
+                self.tokens.take(extra_tokens)
+            self._condition.notify_all()
+
+    def backoff_delay(self, attempt, error):
+        """Seconds to wait before retry number `attempt` (starting at 1)."""
+        requested = retry_after(error)
+        if requested is not None:
+            return min(requested, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+    def call(self, fn, stage=None, tokens=0, response_tokens=None, on_retry=None):
+        """
+        Call fn() once admitted, retrying retryable failures, and return its result.
+        response_tokens(result), if given, returns the tokens to charge for the response.
+        on_retry(attempt, error) is called before each retry.
+        """
+        attempt = 0
+        while True:
+            self.acquire(stage, tokens)
+            result = None
+            try:
+                result = fn()
+            except Exception as e:
+                self.release()
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                attempt += 1
+                if on_retry is not None:
+                    on_retry(attempt, e)
+                time.sleep(self.backoff_delay(attempt, e))
+                continue
+            self.release(response_tokens(result) if response_tokens is not None else 0)
+            return result
+
+    def stream(self, fn, stage=None, tokens=0, response_tokens=None, on_retry=None):
+        """
+        Streaming version of call(): fn() returns an iterator of chunks, which are yielded
+        as they arrive. A failure is only retried if no chunk has been yielded yet.
+        The chunks are not kept: response_tokens(length) is given the total number of
+        characters streamed.
+        """
+        attempt = 0
+        while True:
+            self.acquire(stage, tokens)
+            yielded, length = False, 0
+            try:
+                for chunk in fn():
+                    yielded, length = True, length + len(chunk)
+                    yield chunk
+            except Exception as e:
+                self.release()
+                if yielded or attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                attempt += 1
+                if on_retry is not None:
+                    on_retry(attempt, e)
+                time.sleep(self.backoff_delay(attempt, e))
+                continue
+            except BaseException:
+                # Generator closed early (e.g. GeneratorExit): just free the slot.
+                self.release()
+                raise
+            self.release(response_tokens(length) if response_tokens is not None else 0)
+            return
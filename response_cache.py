@@ -0,0 +1,142 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+class CacheMissError(KeyError):
+    """Raised in replay mode when a prompt has no recorded response."""
+
+class ResponseCache:
+    """
+    On-disk cache of model responses, stored in a SQLite file.
+    Entries are keyed by a SHA-256 hash of (model, prompt, variant), so re-running the same prompt
+    after a crash returns the stored response instead of calling the model again. variant
+    keeps calls that share a prompt but must stay independent (e.g. parallel reviewers) apart.
+
+    Eviction: entries older than max_age_seconds are dropped, and once the cache holds more
+    than max_entries entries or max_bytes bytes of responses, the least recently used entries
+    are dropped first. Any of the limits can be None to disable it.
+
+    In read_only (replay) mode the database is opened read-only, nothing is written or
+    evicted, and callers are expected to treat a miss as an error (see CacheMissError).
+    """
+
+    def __init__(self, path="response_cache.db", max_entries=None, max_bytes=None,
+                 max_age_seconds=None, read_only=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if read_only:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Replay mode needs an existing cache file: {path}")
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)')
+            self._conn.commit()
+            self.evict()
+
+    @staticmethod
+    def make_key(model, prompt, variant=None):
+        """Return the cache key for a (model, prompt, variant) triple."""
+        digest = hashlib.sha256()
+        digest.update(model.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(prompt.encode("utf-8"))
+        if variant is not None:
+            digest.update(b"\0")
+            digest.update(str(variant).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, model, prompt, variant=None):
+        """Return the cached response for (model, prompt, variant), or None if there is none."""
+        key = self.make_key(model, prompt, variant)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT response, created_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is not None and not self.read_only and self._expired(row[1]):
+                self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if not self.read_only:
+                self._conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+                self._conn.commit()
+            return row[0]
+
+    def put(self, model, prompt, response, variant=None):
+        """Store a response. Does nothing in read_only mode."""
+        if self.read_only:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (self.make_key(model, prompt, variant), model, response, len(response.encode("utf-8")), now, now)
+            )
+            self._conn.commit()
+        self.evict()
+
+    def evict(self):
+        """Drop expired entries, then least recently used entries until the size limits are met."""
+        if self.read_only:
+            return
+        with self._lock:
+            if self.max_age_seconds is not None:
+                self._conn.execute(
+                    'DELETE FROM responses WHERE created_at < ?', (time.time() - self.max_age_seconds,)
+                )
+            if self.max_entries is not None:
+                self._conn.execute('''
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                    )
+                ''', (self.max_entries,))
+            if self.max_bytes is not None:
+                total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+                if total > self.max_bytes:
+                    rows = self._conn.execute('SELECT key, size FROM responses ORDER BY last_access').fetchall()
+                    doomed = []
+                    for key, size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        doomed.append((key,))
+                        total -= size
+                    self._conn.executemany('DELETE FROM responses WHERE key = ?', doomed)
+            self._conn.commit()
+
+    def stats(self):
+        """Return hit/miss counters and the current number of entries and bytes stored."""
+        with self._lock:
+            entries, total_bytes = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses'
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total_bytes}
+
+    def close(self):
+        self._conn.close()
+
+    def _expired(self, created_at):
+        return self.max_age_seconds is not None and created_at < time.time() - self.max_age_seconds
@@ -0,0 +1,46 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+def reviewer_prompt_list(reviewer_prompts, num_reviewers=None):
+    """
+    Return the prompts for `num_reviewers` reviewers.
+    If more reviewers are requested than there are prompts, the prompts are reused in order,
+    each reused copy with a note naming the reviewer and asking for an independent review,
+    so that no two reviewers get the same prompt (or the same cached response).
+    If num_reviewers is None, one reviewer is used per prompt.
+    """
+    if num_reviewers is None:
+        return list(reviewer_prompts)
+    if num_reviewers < 1 or not reviewer_prompts:
+        raise ValueError("At least one reviewer and one reviewer prompt are required.")
+    prompts = []
+    for i in range(num_reviewers):
+        prompt = reviewer_prompts[i % len(reviewer_prompts)]
+        if i >= len(reviewer_prompts):
+            prompt += (
+                f"\n\nYou are reviewer {i + 1} of {num_reviewers}. Other reviewers received the same instructions, "
+                "so review the code independently and look especially for problems they may have overlooked."
+            )
+        prompts.append(prompt)
+    return prompts
+
+def run_reviews(code, reviewer_prompts, review_fn, model=None, max_workers=2):
+    """
+    Send every reviewer prompt for the same code at once and gather the outputs.
+    review_fn is called as review_fn(code, reviewer_prompt, reviewer=index) (plus model=model when
+    a model is given), so the real review_code and simple stand-ins can both be used.
+    The reviewer index keeps reviewers that share a prompt independent in the response cache.
+    At most max_workers reviews are in flight at any time. The outputs are returned
+    in the same order as reviewer_prompts, regardless of which review finishes first.
+    If any review raises, the exception is re-raised here.
+    """
+    kwargs = {"model": model} if model is not None else {}
+    if max_workers <= 1 or len(reviewer_prompts) <= 1:
+        return [review_fn(code, prompt, reviewer=i, **kwargs) for i, prompt in enumerate(reviewer_prompts)]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(reviewer_prompts))) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, review_fn, code, prompt, reviewer=i, **kwargs)
+            for i, prompt in enumerate(reviewer_prompts)
+        ]
+        return [future.result() for future in futures]
@@ -0,0 +1,168 @@
+"""
+Thread-safe pool of SQLite connections, shared by the Flask apps in website_files and todo_app.
+It lives in this folder on its own, which each app adds to the end of sys.path.
+
+Opening a connection and applying its pragmas costs more than the small queries these apps
+run, so connections are opened once and reused. Each connection keeps its cache of prepared
+statements (sqlite3's cached_statements), so a query a view runs again is not parsed again.
+
+    POOL = ConnectionPool('database.db', size=8, pragmas=PRAGMAS)
+    with POOL.connection() as conn:
+        conn.execute('SELECT ...')
+
+A connection is only ever used by one thread at a time: acquire() hands it out and release()
+takes it back. Idle connections are checked with a trivial query before being handed out
+again, and broken ones are replaced.
+"""
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Per-connection settings used by both apps. WAL lets readers run alongside a writer; with WAL,
+# synchronous=NORMAL only syncs at checkpoints, and a crash can lose the last commits but never
+# corrupts the database. busy_timeout makes a connection wait for a competing writer instead of
+# failing at once. Databases opened with these must be switched to WAL (PRAGMA journal_mode = WAL).
+PRAGMAS = [
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),  # negative: KiB, so about 16 MB of page cache per connection
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', 5000),
+]
+
+class PoolTimeoutError(Exception):
+    pass
+
+class ConnectionPool:
+    """
+    Up to size connections to one database file. pragmas is a list of (name, value) pairs run
+    on every new connection, cached_statements the number of prepared statements each
+    connection keeps, and health_check_interval how long (in seconds) a connection can sit
+    idle before it is checked again on acquire().
+    """
+
+    def __init__(self, database, size=5, pragmas=(), row_factory=sqlite3.Row, timeout=30,
+                 cached_statements=256, health_check_interval=30):
+        if size < 1:
+            raise ValueError('Pool size must be at least 1.')
+        self.database = database
+        self.size = size
+        self.pragmas = list(pragmas)
+        self.row_factory = row_factory
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.health_check_interval = health_check_interval
+        self._idle = []  # (connection, time it was released), most recently used last
+        self._open = 0
+        self._condition = threading.Condition()
+        self.stats = {'created': 0, 'reused': 0, 'replaced': 0, 'waits': 0}
+
+    def _connect(self):
+        # Connections move between threads, but only while they are in the pool.
+        conn = sqlite3.connect(
+            self.database, timeout=self.timeout, check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.row_factory = self.row_factory
+        for name, value in self.pragmas:
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _healthy(self, conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self, timeout=None):
+        """
+        Return a connection, opening one if fewer than size are open, otherwise waiting up to
+        timeout seconds (the pool's timeout by default) for one to be released.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not self._idle and self._open >= self.size:
+                self.stats['waits'] += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    if not self._idle and self._open >= self.size:
+                        raise PoolTimeoutError(f'No database connection became free within {timeout} s.')
+            if self._idle:
+                conn, released_at = self._idle.pop()
+            else:
+                conn, released_at = None, None
+                self._open += 1
+
+        if conn is not None:
+            if time.monotonic() - released_at < self.health_check_interval or self._healthy(conn):
+                self._count('reused')
+                return conn
+            logger.warning(f'Replacing broken connection to {self.database}.')
+            self._count('replaced')
+            self._close_quietly(conn)
+        try:
+            conn = self._connect()
+        except BaseException:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+        self._count('created')
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Return a connection to the pool. A transaction left open is rolled back, so the next
+        user starts clean; with discard=True (or if the rollback fails) the connection is closed.
+        """
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+        if discard:
+            self._close_quietly(conn)
+        with self._condition:
+            if discard:
+                self._open -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Acquire a connection for the duration of a with block."""
+        conn = self.acquire(timeout)
+        try:
+            yield conn
+        except sqlite3.DatabaseError:
+            self.release(conn, discard=not self._healthy(conn))
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        self.release(conn)
+
+    def _count(self, name):
+        with self._condition:
+            self.stats[name] += 1
+
+    def close(self):
+        """Close the idle connections (e.g. at shutdown). Connections in use are not affected."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
@@ -0,0 +1,109 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+class StageGraph:
+    """
+    Runs named stages as a dependency graph: a stage starts as soon as all of the stages
+    it depends on have finished, so independent stages overlap on a thread pool.
+
+    run() returns a trace with the start and end time of every stage (seconds since the
+    run started), which critical_path() turns into the chain of stages that determined
+    the total wall-clock time.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, fn, deps=()):
+        """Add a stage. fn is called with no arguments; deps are names of earlier stages."""
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}.")
+        self.stages[name] = (fn, tuple(deps))
+
+    def deps(self, name):
+        return self.stages[name][1]
+
+    def run(self, completed=(), max_workers=4, on_complete=None):
+        """
+        Run every stage not listed in completed, respecting dependencies.
+        on_complete(name) is called from the calling thread after each stage finishes,
+        one stage at a time (e.g. to write a checkpoint).
+        If a stage raises, no new stages are started, the running ones are allowed to
+        finish, and the first exception is re-raised.
+        Returns the trace: a list of {"stage", "start", "end", "thread"} dictionaries.
+        """
+        done = set(completed)
+        pending = [name for name in self.stages if name not in done]
+        running = {}
+        trace = []
+        error = None
+        origin = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while pending or running:
+                if error is None:
+                    ready = [name for name in pending if all(dep in done for dep in self.deps(name))]
+                    for name in ready:
+                        pending.remove(name)
+                        # Each stage runs in a copy of the caller's context (see metrics.CURRENT_JOB).
+                        running[pool.submit(contextvars.copy_context().run, self._run_stage, name, origin)] = name
+                if not running:
+                    if error is None:
+                        raise ValueError(f"Stages can never run, check their dependencies: {pending}")
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        trace.append(future.result())
+                    except Exception as e:
+                        if error is None:
+                            error = e
+                        continue
+                    done.add(name)
+                    if on_complete is not None:
+                        on_complete(name)
+
+        if error is not None:
+            raise error
+        return trace
+
+    def _run_stage(self, name, origin):
+        start = time.perf_counter() - origin
+        self.stages[name][0]()
+        end = time.perf_counter() - origin
+        return {"stage": name, "start": start, "end": end, "thread": threading.current_thread().name}
+
+def critical_path(trace, deps):
+    """
+    Walk back from the stage that finished last, each time following the dependency that
+    finished last, to find the chain of stages that bounded the run's wall-clock time.
+    deps(name) returns the dependencies of a stage. Stages missing from the trace
+    (e.g. completed before a resume) are skipped.
+    Returns the list of stage names in execution order.
+    """
+    by_name = {record["stage"]: record for record in trace}
+    if not by_name:
+        return []
+    path = []
+    current = max(by_name.values(), key=lambda record: record["end"])
+    while current is not None:
+        path.append(current["stage"])
+        parents = [by_name[dep] for dep in deps(current["stage"]) if dep in by_name]
+        current = max(parents, key=lambda record: record["end"]) if parents else None
+    return list(reversed(path))
+
+def format_trace(trace, deps):
+    """Return a printable table of the trace, marking stages on the critical path with '*'."""
+    path = set(critical_path(trace, deps))
+    lines = [f"  {'stage':<14} {'start (s)':>10} {'end (s)':>10} {'took (s)':>10}"]
+    for record in sorted(trace, key=lambda record: record["start"]):
+        marker = "*" if record["stage"] in path else " "
+        lines.append(
+            f"{marker} {record['stage']:<14} {record['start']:>10.2f} {record['end']:>10.2f} "
+            f"{record['end'] - record['start']:>10.2f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,162 @@
+"""
+Local, offline stand-in for the OpenAI chat completions endpoint.
+
+Usage: python stub_server.py [--port 8765] [--num-files 5] [--latency 0.0]
+                             [--latency-jitter 0.0] [--rate-limit-rate 0.0] [--error-rate 0.0]
+                             [--retry-after 1] [--seed N]
+
+Answers POST /v1/chat/completions (plain and streamed) with backends.StubBackend, so the
+real OpenAI client code path can be exercised without network access. Point the
+orchestrator at it with {"backend": {"type": "openai", "base_url": "http://127.0.0.1:8765/v1"}}
+and any api_key.
+
+To exercise the orchestrator's retries and rate limiting (see rate_limit.py), the server
+can answer a random fraction of requests with 429 Too Many Requests (with a Retry-After
+header) or 500 Internal Server Error, and add a random extra delay to every response.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backends import StubBackend
+
+def completion_body(model, content):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+def chunk_body(model, content, finish_reason=None):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": {"content": content} if content else {}, "finish_reason": finish_reason}],
+    }
+
+def error_body(message, error_type, code):
+    return {"error": {"message": message, "type": error_type, "param": None, "code": code}}
+
+class StubHandler(BaseHTTPRequestHandler):
+    backend = StubBackend()
+    latency_jitter = 0.0
+    rate_limit_rate = 0.0
+    error_rate = 0.0
+    retry_after = 1
+    random = random.Random()
+    random_lock = threading.Lock()
+    # Number of requests answered with each status code, for checking a test run.
+    counts = {}
+
+    def inject_faults(self):
+        """Add latency and maybe answer with an injected error. Returns True if an error was sent."""
+        with self.random_lock:
+            delay = self.random.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0
+            roll = self.random.random()
+        if delay:
+            time.sleep(delay)
+        if roll < self.rate_limit_rate:
+            self.send_json(429, error_body("Rate limit reached (injected by stub_server).",
+                                           "requests", "rate_limit_exceeded"),
+                           {"Retry-After": str(self.retry_after)})
+            return True
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.send_json(500, error_body("Internal error (injected by stub_server).", "server_error", None))
+            return True
+        return False
+
+    def send_json(self, status, payload, headers=None):
+        with self.random_lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.inject_faults():
+            return
+        model = request.get("model", "stub")
+        prompt = "\n".join(message.get("content", "") for message in request.get("messages", []))
+
+        if request.get("stream"):
+            with self.random_lock:
+                self.counts[200] = self.counts.get(200, 0) + 1
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for chunk in self.backend.stream(prompt, model):
+                self.wfile.write(f"data: {json.dumps(chunk_body(model, chunk))}\n\n".encode("utf-8"))
+            self.wfile.write(f"data: {json.dumps(chunk_body(model, None, 'stop'))}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+
+        self.send_json(200, completion_body(model, self.backend.complete(prompt, model)))
+
+    def log_message(self, format, *args):
+        pass
+
+def make_server(port=8765, num_files=5, latency=0.0, latency_jitter=0.0, rate_limit_rate=0.0,
+                error_rate=0.0, retry_after=1, seed=None):
+    """
+    Create (but don't start) the stub server; port 0 picks a free port.
+    Call serve_forever() on the result, e.g. from a thread in a test script.
+    """
+    StubHandler.backend = StubBackend(num_files=num_files, latency=latency)
+    StubHandler.latency_jitter = latency_jitter
+    StubHandler.rate_limit_rate = rate_limit_rate
+    StubHandler.error_rate = error_rate
+    StubHandler.retry_after = retry_after
+    StubHandler.random = random.Random(seed)
+    StubHandler.counts = {}
+    return ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+
+def serve(port=8765, num_files=5, latency=0.0, **faults):
+    """Run the stub server until interrupted. faults are passed on to make_server."""
+    server = make_server(port, num_files, latency, **faults)
+    print(f"Stub model server listening on http://127.0.0.1:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline stand-in for the OpenAI chat completions API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--num-files", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response")
+    parser.add_argument("--latency-jitter", type=float, default=0.0,
+                        help="up to this many extra seconds, chosen at random, before each response")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0,
+                        help="fraction of requests answered with 429 Too Many Requests")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with 500 Internal Server Error")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--seed", type=int, help="random seed, for reproducible fault injection")
+    args = parser.parse_args()
+    serve(args.port, args.num_files, args.latency, latency_jitter=args.latency_jitter,
+          rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate,
+          retry_after=args.retry_after, seed=args.seed)
@@ -1,178 +1,167 @@
+"""
+Offline test harness for the orchestrator.
+
+Usage: python testing.py [--output-dir DIR] [--max-iterations 5]
+
+Runs the real pipeline (openapi.Pipeline) with the deterministic StubBackend from
+backends.py instead of a model, so the generate -> review -> aggregate -> audit /
+gap-analysis loop, streaming, checkpoints and history are exercised without an API key
+or network access. The stub reviewers make different edits, including one overlapping
+edit, and the stub auditor wraps its output in code fences, so the local merge, the
+conflict prompt, the audit pool, fence stripping and the whitespace-only check all run. The stub streams its output in 7-character chunks, so file headers
+and footers arrive split across chunks. Everything is written to a temporary directory
+unless --output-dir is given. Mismatches are printed as warnings and the exit status is 1.
+"""
+import argparse
 import os
-import re
-
-# ---------------------------
-# CONFIGURATION (unchanged)
-# ---------------------------
-# For testing, we don't need the API key, so we can comment out the config JSON loading.
-# import json
-# with open("config.json", "r") as config_file:
-#     config = json.load(config_file)
-# openai.api_key = config["api_key"]
-
-# ---------------------------
-# Helper Functions (unchanged)
-# ---------------------------
-def safe_print(text):
-    try:
-        print(text)
-    except Exception as e:
-        print(text)
-
-def parse_files(text):
-    """
-    Parse a string in the custom file format.
-    Expected format for each file:
-    
-    ### filename: <filename> ###
-    <file content>
-    ### end ###
-    
-    Returns a dictionary mapping filenames to their content,
-    with the first and last lines removed if they are exactly "```".
-    """
-    pattern = r"### filename: (.*?) ###\s*(.*?)\s*### end ###"
-    matches = re.findall(pattern, text, flags=re.DOTALL)
-    result = {}
-    for filename, content in matches:
-        lines = content.splitlines()
-        if len(lines) >= 2 and lines[0].strip() == "```" and lines[-1].strip() == "```":
-            content = "\n".join(lines[1:-1])
-        else:
-            content = "\n".join(lines)
-        result[filename.strip()] = content.strip()
-    return result
-
-def assemble_files(directory):
-    """
-    Assemble the contents of all files in the given directory into a single string
-    in the custom format.
-    """
-    result = ""
-    for filename in os.listdir(directory):
-        file_path = os.path.join(directory, filename)
-        if os.path.isfile(file_path):
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read().strip()
-            result += f"### filename: {filename} ###\n{content}\n### end ###\n"
-    return result
-
-def write_files(file_dict, output_directory):
-    """
-    Given a dictionary mapping filenames to file contents, write each file to the output_directory.
-    """
-    for filename, content in file_dict.items():
-        file_path = os.path.join(output_directory, filename)
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
-
-# ---------------------------
-# Dummy Model Functions for Testing
-# ---------------------------
-# These functions simulate responses from the API. You can change the returned strings as needed.
-def generate_initial_code(prompt, model="o1-mini"):
-    # Return a sample output in the custom format.
-    return (
-        "### filename: index.html ###\n"
-        "<html><body><h1>Banana Shop</h1></body></html>\n"
-        "### end ###\n"
-        "### filename: style.css ###\n"
-        "body { background-color: yellow; }\n"
-        "### end ###"
-    )
-
-def review_code(code, reviewer_prompt, model="o1-mini"):
-    # For testing, just return the input code unmodified (or modify it slightly).
-    return code.replace("Banana Shop", "The Banana Shop")
-
-def aggregate_reviews(original_code, review1, review2, model="o1-mini"):
-    # For testing, simply return the version from reviewer1.
-    return review1
-
-def gap_analysis(code_text, model="o1-mini"):
-    # For testing, return a dummy analysis string.
-    return "Consider adding a navigation bar and contact form validation."
-
-# ---------------------------
-# MAIN ORCHESTRATION (Intermediate data kept in memory)
-# ---------------------------
+import sys
+import tempfile
 
-# Directory to write website files.
-WEBSITE_DIR = "website_files"
-os.makedirs(WEBSITE_DIR, exist_ok=True)
+import openapi
+from backends import StubBackend, make_backend
+from parsing import UNTERMINATED, StreamingFileParser, parse_file_blocks
+from workspace import get_snapshot
 
-base_prompt = (
+BASE_PROMPT = (
     "Create a website in HTML, CSS, and JavaScript for selling bananas. "
     "Include a homepage, product listing, and a contact form."
 )
-
-max_iterations = 5
-iteration = 0
-previous_aggregated_code = ""
-
-while iteration < max_iterations:
-    safe_print(f"\n===== Iteration {iteration+1} =====\n")
-    
-    # --- Pre-run Gap Analysis & Prompt Update ---
-    if os.listdir(WEBSITE_DIR):
-        safe_print("Scanning current website files for pre-run gap analysis...")
-        current_files_str = assemble_files(WEBSITE_DIR)
-        pre_analysis = gap_analysis(current_files_str)
-        safe_print("Pre-run Gap Analysis suggestions:")
-        safe_print(pre_analysis)
-        updated_prompt = (
-            base_prompt +
-            "\n\nCurrent website files:\n" + current_files_str +
-            "\n\nIncorporate the following improvements:\n" + pre_analysis
-        )
-    else:
-        updated_prompt = base_prompt
-
-    safe_print("Updated prompt for code generation:")
-    safe_print(updated_prompt)
-
-    # --- Step 1: Initial Code Generation ---
-    initial_code_output = generate_initial_code(updated_prompt)
-    safe_print("Initial code generated:")
-    safe_print(initial_code_output)
-    initial_files = parse_files(initial_code_output)
-    write_files(initial_files, WEBSITE_DIR)
-
-    # --- Step 2: Reviews ---
-    review1_output = review_code(initial_code_output, "Please review the code and fix any errors or issues you see.")
-    safe_print("Reviewer 1 output:")
-    safe_print(review1_output)
-    review2_output = review_code(initial_code_output, "Please inspect the code for any bugs or improvements and return a corrected version.")
-    safe_print("Reviewer 2 output:")
-    safe_print(review2_output)
-
-    # --- Step 3: Aggregation ---
-    aggregated_code_output = aggregate_reviews(initial_code_output, review1_output, review2_output)
-    safe_print("Aggregated final code:")
-    safe_print(aggregated_code_output)
-    aggregated_files = parse_files(aggregated_code_output)
-    write_files(aggregated_files, WEBSITE_DIR)
-
-    # --- Step 4: Post-run Gap Analysis ---
-    post_analysis = gap_analysis(aggregated_code_output)
-    safe_print("Post-run Gap Analysis suggestions:")
-    safe_print(post_analysis)
-
-    # --- Update Base Prompt with Latest Analysis ---
-    base_prompt = (
-        "Create a website in HTML, CSS, and JavaScript for selling bananas. "
-        "Include a homepage, product listing, and a contact form."
-        "\n\nIncorporate the following improvements based on the latest gap analysis:\n" + post_analysis
+STREAM_CHUNK_SIZE = 7
+
+def stream_files(chunks):
+    # Feed chunks to a StreamingFileParser the way the orchestrator does.
+    # Returns the files it completed, in order, and its diagnostics.
+    parser = StreamingFileParser()
+    files = []
+    for chunk in chunks:
+        files.extend(parser.feed(chunk))
+    files.extend(parser.close())
+    return files, parser.diagnostics
+
+# Outputs whose headers and footers end up split across chunk boundaries, one whose
+# last block has no footer, and one with a footer after text on the same line.
+STREAMING_CASES = [
+    "### filename: index.html ###\n<h1>Hi</h1>\n### end ###\n### filename: js/app.js ###\nalert(1);\n### end ###",
+    "### filename: a.txt ###\nfirst\n### end ###\n### filename: b.txt ###\nno footer here\n",
+    "### filename: a.py ###\n```python\nx = 1\n```\n### end ###\n### filename: README.md ###\n```\nkeep\n```\ntext\n### end ###",
+    "### filename: a.txt ###\nvalue ### end ###\n### filename: b.txt ###\nb\n### end ###",
+    "### filename: a.txt ### content\n### end ###\n### filename: b.txt ### b ### end ###",
+]
+
+def check_streaming_parser():
+    # Every case is streamed in chunks of every size from 1 character to the whole text,
+    # so every header and footer is split at every possible position at least once.
+    # The streamed files and diagnostics must match parsing the whole text at once.
+    failures = []
+    for case in STREAMING_CASES:
+        expected_files, expected_diagnostics = parse_file_blocks(case)
+        for chunk_size in range(1, len(case) + 1):
+            chunks = [case[start:start + chunk_size] for start in range(0, len(case), chunk_size)]
+            files, diagnostics = stream_files(chunks)
+            if dict(files) != expected_files or diagnostics != expected_diagnostics:
+                failures.append(f"chunk size {chunk_size}: {case[:40]!r}...")
+                break
+    # A last block without a footer is reported and dropped, streamed or not.
+    _, diagnostics = stream_files([STREAMING_CASES[1]])
+    if [diagnostic.kind for diagnostic in diagnostics] != [UNTERMINATED]:
+        failures.append("a final block with no footer was not reported as unterminated")
+    # Text after a header on the same line is the file's first line, as with text before a footer.
+    if parse_file_blocks(STREAMING_CASES[4]) != ({"a.txt": "content", "b.txt": "b"}, []):
+        failures.append("text after a header on the same line was not parsed as the file's first line")
+    return failures
+
+def check_backend_stream(backend):
+    # The files parsed from the stub's 7-character stream must match a parse of its whole output.
+    prompt = openapi.generation_prompt(BASE_PROMPT)
+    output = backend.complete(prompt, openapi.DEFAULT_MODEL, "generate")
+    files, _ = stream_files(backend.stream(prompt, openapi.DEFAULT_MODEL, "generate"))
+    if dict(files) != parse_file_blocks(output)[0]:
+        return ["files parsed from the stream do not match parse_file_blocks of the whole output"]
+    return []
+
+# What the stub reviewers' edits (see StubBackend.REVIEW_EDITS) must leave in the output:
+# (filename, text, what it shows). app.py is the file both reviewers changed on the same line.
+EXPECTED_EDITS = [
+    ("module_1.html", "heading fixed by the first reviewer", "a change made by one reviewer"),
+    ("module_2.css", "colour fixed by the first reviewer", "non-overlapping changes merged locally"),
+    ("module_2.css", "margin fixed by the second reviewer", "non-overlapping changes merged locally"),
+    ("app.py", StubBackend.RESOLVED_MARKER, "an overlapping change resolved by the aggregate model call"),
+]
+
+def check_output(pipeline, iterations):
+    # After the run, the output directory must hold the files of the last aggregated code,
+    # with the reviewers' edits merged, the conflict resolved and the audits' fences removed.
+    _, state = pipeline.checkpoints.latest()
+    expected = parse_file_blocks(state["aggregated_code_output"])[0]
+    written = get_snapshot(pipeline.output_dir).files()
+    failures = []
+    if written != expected:
+        missing = sorted(set(expected) - set(written))
+        different = sorted(path for path in expected if path in written and written[path] != expected[path])
+        failures.append(f"output directory does not match the aggregated code (missing: {missing}, different: {different})")
+    for filename, text, shows in EXPECTED_EDITS:
+        if text not in written.get(filename, ""):
+            failures.append(f"{filename} lacks {text!r}, so the run did not show {shows}")
+    if not any(line.endswith("   ") for line in written.get("module_3.js", "").split("\n")):
+        failures.append("module_3.js lost the reviewer's whitespace-only change")
+    fenced = sorted(path for path, content in written.items() if "```" in content)
+    if fenced:
+        failures.append(f"code fences from the audits were written to {fenced}")
+    # Per iteration: one conflict prompt, and audits of the three files with real changes
+    # (module_3.js only changed whitespace and module_4.py not at all).
+    totals = openapi.METRICS.summary()
+    calls = {stage: totals.get(stage, {}).get("calls", 0) for stage in ("aggregate", "audit")}
+    if calls != {"aggregate": iterations, "audit": 3 * iterations}:
+        failures.append(f"expected {iterations} aggregate and {3 * iterations} audit calls, got {calls}")
+    return failures
+
+def generate_synthetic_code(num_files, total_bytes):
+    # Return a large sample output in the custom format, for benchmarks:
+    # num_files files (HTML, CSS and JS) adding up to roughly total_bytes of text.
+    # Every file mentions "Banana Shop", so a review can change all of them.
+    extensions = [".html", ".css", ".js"]
+    line = "<p>Fresh bananas from the Banana Shop, picked today and shipped tomorrow.</p>\n"
+    lines_per_file = max(1, total_bytes // (num_files * len(line)))
+    body = line * lines_per_file
+    parts = []
+    for index in range(num_files):
+        filename = f"pages/section_{index // 100}/page_{index}{extensions[index % len(extensions)]}"
+        parts.append(f"### filename: {filename} ###\n{body}### end ###\n")
+    return "".join(parts)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the orchestration pipeline offline against the stub backend.")
+    parser.add_argument("--output-dir", help="directory for the generated files (default: a temporary directory)")
+    parser.add_argument("--max-iterations", type=int, default=openapi.MAX_ITERATIONS)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="testing_")
+    output_dir = args.output_dir or os.path.join(workdir, "website_files")
+    prompt_file = os.path.join(workdir, "BasePrompt.txt")
+    with open(prompt_file, "w", encoding="utf-8") as f:
+        f.write(BASE_PROMPT)
+
+    backend = make_backend({"type": "stub", "chunk_size": STREAM_CHUNK_SIZE})
+    openapi.set_backend(backend)
+
+    failures = check_streaming_parser() + check_backend_stream(backend)
+    pipeline = openapi.Pipeline(
+        output_dir=output_dir,
+        prompt_file=prompt_file,
+        feedback_path=os.path.join(workdir, "feedback.txt"),
+        checkpoint_dir=os.path.join(workdir, "json_outputs"),
+        max_iterations=args.max_iterations,
     )
-    safe_print("Base prompt updated for next iteration:")
-    safe_print(base_prompt)
-
-    if aggregated_code_output.strip() == previous_aggregated_code.strip():
-        safe_print("No changes detected in aggregated code. Terminating loop.")
-        break
-    else:
-        previous_aggregated_code = aggregated_code_output
-
-    iteration += 1
+    iterations = pipeline.run()
+    failures += check_output(pipeline, iterations)
+
+    for failure in failures:
+        openapi.safe_print(f"WARNING: {failure}")
+    openapi.safe_print(
+        f"Offline run: {iterations} iterations, {backend.calls} stub model calls, {len(failures)} problems. "
+        f"Files are in '{output_dir}'."
+    )
+    return 1 if failures else 0
 
-safe_print(f"\nAll iterations complete. Website files are in '{WEBSITE_DIR}'.")
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,12 @@
 import os
-import sqlite3
+import sys
 from flask import Flask, render_template, request, redirect, url_for
 import logging
 
+# sqlite_pool.py is shared with website_files and lives in ../shared.
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shared'))
+from sqlite_pool import PRAGMAS, ConnectionPool
+
 app = Flask(__name__)
 
 # Configure logging
@@ -12,76 +16,76 @@ logger = logging.getLogger(__name__)
 # Database configuration
 DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.db')
 
+# Connections are opened once, with the same pragmas as website_files (see sqlite_pool.PRAGMAS),
+# and reused by every request. DB_POOL_SIZE caps how many are open at a time.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+db_pool = ConnectionPool(DATABASE, size=DB_POOL_SIZE, pragmas=PRAGMAS)
+
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Borrow a pooled connection for a with block; it goes back to the pool at the end."""
+    return db_pool.connection()
 
 def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT
-        )
-    ''')
-    # Insert initial data if table is empty
-    cursor.execute('SELECT COUNT(*) FROM tasks')
-    count = cursor.fetchone()[0]
-    if count == 0:
-        cursor.executemany('INSERT INTO tasks (title, description) VALUES (?, ?)', [
-            ('Sample Task 1', 'This is the first sample task.'),
-            ('Sample Task 2', 'This is the second sample task.')
-        ])
-        logger.info('Inserted initial sample tasks into the database.')
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        # PRAGMAS assume WAL mode; it is stored in the database file, so this only takes effect once.
+        conn.execute('PRAGMA journal_mode = WAL')
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                description TEXT
+            )
+        ''')
+        # Insert initial data if table is empty
+        cursor.execute('SELECT COUNT(*) FROM tasks')
+        count = cursor.fetchone()[0]
+        if count == 0:
+            cursor.executemany('INSERT INTO tasks (title, description) VALUES (?, ?)', [
+                ('Sample Task 1', 'This is the first sample task.'),
+                ('Sample Task 2', 'This is the second sample task.')
+            ])
+            logger.info('Inserted initial sample tasks into the database.')
+        conn.commit()
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if request.method == 'POST':
-        title = request.form['title']
-        description = request.form['description']
-        cursor.execute('INSERT INTO tasks (title, description) VALUES (?, ?)', (title, description))
-        conn.commit()
-        logger.info(f'Added task: {title}')
-        conn.close()
-        return redirect(url_for('index'))
-    
-    cursor.execute('SELECT * FROM tasks')
-    tasks = cursor.fetchall()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if request.method == 'POST':
+            title = request.form['title']
+            description = request.form['description']
+            cursor.execute('INSERT INTO tasks (title, description) VALUES (?, ?)', (title, description))
+            conn.commit()
+            logger.info(f'Added task: {title}')
+            return redirect(url_for('index'))
+
+        cursor.execute('SELECT * FROM tasks')
+        tasks = cursor.fetchall()
     return render_template('index.html', tasks=tasks)
 
 @app.route('/update/<int:task_id>', methods=['GET', 'POST'])
 def update(task_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if request.method == 'POST':
-        title = request.form['title']
-        description = request.form['description']
-        cursor.execute('UPDATE tasks SET title = ?, description = ? WHERE id = ?', (title, description, task_id))
-        conn.commit()
-        logger.info(f'Updated task ID {task_id} to title: {title}')
-        conn.close()
-        return redirect(url_for('index'))
-    
-    cursor.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
-    task = cursor.fetchone()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if request.method == 'POST':
+            title = request.form['title']
+            description = request.form['description']
+            cursor.execute('UPDATE tasks SET title = ?, description = ? WHERE id = ?', (title, description, task_id))
+            conn.commit()
+            logger.info(f'Updated task ID {task_id} to title: {title}')
+            return redirect(url_for('index'))
+
+        cursor.execute('SELECT * FROM tasks WHERE id = ?', (task_id,))
+        task = cursor.fetchone()
     return render_template('update.html', task=task)
 
 @app.route('/delete/<int:task_id>', methods=['POST'])
 def delete(task_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+        conn.commit()
     logger.info(f'Deleted task ID {task_id}')
     return redirect(url_for('index'))
 
@@ -1,25 +1,46 @@
+import hashlib
 import os
 import sqlite3
+import sys
+import threading
+import time
 import uuid
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, abort, g
+from datetime import datetime, timezone
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, abort, g
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.datastructures import ContentRange, Headers
 from werkzeug.utils import secure_filename
 from functools import wraps
 from cryptography.fernet import Fernet
 import logging
-from io import BytesIO
 from flask_wtf import CSRFProtect
 
+# sqlite_pool.py (used by db_schema too) is shared with todo_app and lives in ../shared.
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shared'))
+from db_schema import PRAGMAS, check_query_plans, migrate
+from encrypted_files import DecryptionError, EncryptedFile, encrypt_file
+from key_manager import KeyManager
+from sqlite_pool import ConnectionPool
+
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24))
 DATABASE = 'database.db'
 UPLOAD_FOLDER = 'uploads'
 ENCRYPTION_KEY_FILE = 'secret.key'
+# Seconds between runs of the background job that re-encrypts files with the current key,
+# and how many files it re-encrypts per run. Set REENCRYPT_INTERVAL to 0 to disable it.
+REENCRYPT_INTERVAL = int(os.environ.get('REENCRYPT_INTERVAL', 60))
+REENCRYPT_BATCH_SIZE = int(os.environ.get('REENCRYPT_BATCH_SIZE', 20))
+# Database connections are opened once and reused by requests; DB_POOL_SIZE caps how many are open.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limit upload size to 16MB
+# Uploads are encrypted and downloads decrypted in fixed-size segments, so memory use per request
+# doesn't grow with the file size. Set MAX_CONTENT_LENGTH (in bytes, 0 for no limit) to change the 1 GB limit.
+MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 1024 * 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH or None
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 csrf = CSRFProtect(app)
@@ -36,51 +57,26 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+db_pool = ConnectionPool(DATABASE, size=DB_POOL_SIZE, pragmas=PRAGMAS)
+
 def get_db():
     if 'db' not in g:
-        g.db = sqlite3.connect(DATABASE)
-        g.db.row_factory = sqlite3.Row
+        g.db = db_pool.acquire()
     return g.db
 
 @app.teardown_appcontext
 def close_db(exc):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
 
 def init_db():
+    """Bring the database schema up to date and warn about queries that would scan whole tables."""
     with app.app_context():
         db = get_db()
-        cursor = db.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS files (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                original_filename TEXT NOT NULL,
-                stored_filename TEXT NOT NULL,
-                user_id INTEGER NOT NULL,
-                upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                file_size INTEGER,
-                FOREIGN KEY(user_id) REFERENCES users(id)
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS shared_links (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                file_id INTEGER NOT NULL,
-                shared_link TEXT UNIQUE NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(file_id) REFERENCES files(id)
-            )
-        ''')
-        db.commit()
+        migrate(db)
+        check_query_plans(db)
+        db.execute('PRAGMA optimize')
 
 def generate_encryption_key():
     if not os.path.exists(ENCRYPTION_KEY_FILE):
@@ -89,15 +85,177 @@ def generate_encryption_key():
             key_file.write(key)
         logging.info('Encryption key generated and saved.')
 
-def load_encryption_key():
-    if 'encryption_key' not in g:
-        if os.path.exists(ENCRYPTION_KEY_FILE):
-            with open(ENCRYPTION_KEY_FILE, 'rb') as key_file:
-                g.encryption_key = key_file.read()
-        else:
-            logging.error('Encryption key file not found.')
-            raise FileNotFoundError('Encryption key file not found.')
-    return g.encryption_key
+# Encryption keys and their cipher objects, loaded once per process. New key files (see
+# --rotate-key) are picked up within KEY_CHECK_INTERVAL seconds.
+KEY_CHECK_INTERVAL = float(os.environ.get('KEY_CHECK_INTERVAL', 1))
+KEYS = KeyManager(ENCRYPTION_KEY_FILE, check_interval=KEY_CHECK_INTERVAL)
+
+class ChunkReader:
+    """File-like read() over an iterator of byte chunks, for re-encrypting one segment at a time."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def read(self, size):
+        while len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+
+def delete_retired_files(db):
+    """
+    Delete the files earlier re-encryption batches replaced (the retired_files table), then
+    their rows. A file that can't be deleted keeps its row and is tried again next time.
+    Returns the number of files deleted.
+    """
+    deleted = 0
+    for row in db.execute('SELECT id, stored_filename FROM retired_files').fetchall():
+        path = os.path.join(UPLOAD_FOLDER, row['stored_filename'])
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f'Could not delete re-encrypted file {path}: {e}')
+            continue
+        with db:
+            db.execute('DELETE FROM retired_files WHERE id = ?', (row['id'],))
+        deleted += 1
+    return deleted
+
+def reencrypt_batch(batch_size=REENCRYPT_BATCH_SIZE):
+    """
+    Re-encrypt up to batch_size files that were encrypted with an older key (or stored whole
+    with Fernet under one) with the current key. Each file is written under a new name and
+    its row updated in one transaction, so downloads never see a half-migrated file.
+    The old file is recorded in retired_files in the same transaction and deleted by the next
+    batch, so downloads that started before the update can still finish, and a restart in
+    between doesn't leave it behind. Returns the number of files re-encrypted.
+    """
+    KEYS.reload()
+    current = KEYS.current()
+    migrated = 0
+    with db_pool.connection() as db:
+        delete_retired_files(db)
+        rows = db.execute(
+            'SELECT id, original_filename, stored_filename, key_id FROM files WHERE key_id < ? LIMIT ?',
+            (current.key_id, batch_size)
+        ).fetchall()
+        for row in rows:
+            old_path = os.path.join(UPLOAD_FOLDER, row['stored_filename'])
+            new_filename = f"{uuid.uuid4().hex}_{row['original_filename']}"
+            new_path = os.path.join(UPLOAD_FOLDER, new_filename)
+            try:
+                encrypted = EncryptedFile(old_path, KEYS.get(row['key_id']))
+                with ChunkReader(encrypted.iter_chunks()) as source:
+                    file_size = encrypt_file(source, new_path, current)
+                with db:
+                    updated = db.execute(
+                        'UPDATE files SET stored_filename = ?, key_id = ?, file_size = ? WHERE id = ? AND key_id = ?',
+                        (new_filename, current.key_id, file_size, row['id'], row['key_id'])
+                    ).rowcount
+                    if updated:
+                        db.execute('INSERT INTO retired_files (stored_filename) VALUES (?)', (row['stored_filename'],))
+            except Exception as e:
+                logging.error(f'Re-encryption failed for file ID {row["id"]}: {e}')
+                if os.path.exists(new_path):
+                    os.remove(new_path)
+                continue
+            if not updated:
+                # The file was deleted (or re-encrypted elsewhere) meanwhile: its row no longer
+                # points at old_path, so only the copy made here is removed.
+                os.remove(new_path)
+                continue
+            migrated += 1
+    if migrated:
+        logging.info(f'Re-encrypted {migrated} files with key {current.key_id}.')
+    return migrated
+
+def start_reencryption_worker(interval=REENCRYPT_INTERVAL):
+    """Run reencrypt_batch every interval seconds in a daemon thread."""
+    def run():
+        while True:
+            try:
+                reencrypt_batch()
+            except Exception as e:
+                logging.error(f'Re-encryption job failed: {e}')
+            time.sleep(interval)
+
+    worker = threading.Thread(target=run, name='reencryption', daemon=True)
+    worker.start()
+    return worker
+
+def requested_range(size, etag, last_modified):
+    """
+    Return the (start, stop) byte range the request asks for, None to send the whole file,
+    or 'unsatisfiable' for a range outside the file. Multiple ranges are answered with the
+    whole file, and so is a range whose If-Range validator no longer matches the file.
+    """
+    byte_range = request.range
+    if byte_range is None or byte_range.units != 'bytes' or len(byte_range.ranges) != 1:
+        return None
+    if_range = request.if_range
+    if if_range.etag is not None and if_range.etag != etag:
+        return None
+    if if_range.date is not None and if_range.date != last_modified:
+        return None
+    bounds = byte_range.range_for_length(size)
+    return bounds if bounds is not None else 'unsatisfiable'
+
+def decrypted_file_response(file_path, download_name, key_id):
+    """
+    Stream a stored file back decrypted, one segment at a time. Byte ranges (Range, If-Range)
+    are answered with 206 Partial Content, decrypting only the segments the range covers, so
+    interrupted downloads can be resumed and media can be previewed.
+    Files stored whole with Fernet before the streaming format existed are decrypted in one
+    go but still sent in chunks.
+    Raises DecryptionError or cryptography.fernet.InvalidToken if the file can't be decrypted.
+    """
+    encrypted = EncryptedFile(file_path, KEYS.get(key_id))
+    size = encrypted.plaintext_size()
+    stat = os.stat(file_path)
+    # Strong validator for If-Range: changes whenever the stored file is replaced.
+    etag = hashlib.sha256(f'{file_path}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:32]
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+
+    headers = Headers()
+    headers.add('Content-Disposition', 'attachment', filename=download_name)
+    headers['Accept-Ranges'] = 'bytes'
+    bounds = requested_range(size, etag, last_modified)
+    if bounds == 'unsatisfiable':
+        headers['Content-Range'] = f'bytes */{size}'
+        return Response(status=416, headers=headers)
+    start, stop = bounds if bounds is not None else (0, size)
+
+    def generate():
+        try:
+            for chunk in encrypted.iter_range(start, stop):
+                yield chunk
+        except DecryptionError as e:
+            # The headers are already sent, so all that can be done is to cut the download short.
+            logging.error(f'Decryption failed while streaming {file_path}: {e}')
+            raise
+
+    headers['Content-Length'] = str(stop - start)
+    response = Response(generate(), mimetype='application/octet-stream', headers=headers)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    if bounds is not None:
+        response.status_code = 206
+        response.content_range = ContentRange('bytes', start, stop, size)
+    return response
 
 def generate_shared_link():
     while True:
@@ -194,18 +352,14 @@ def upload():
             original_filename = secure_filename(file.filename)
             stored_filename = f"{uuid.uuid4().hex}_{original_filename}"
             try:
-                key = load_encryption_key()
-                fernet = Fernet(key)
+                key = KEYS.current()
             except FileNotFoundError:
                 flash('Encryption key not found.')
                 return redirect(request.url)
-            raw_data = file.read()
-            encrypted_data = fernet.encrypt(raw_data)
             file_path = os.path.join(app.config['UPLOAD_FOLDER'], stored_filename)
             try:
-                with open(file_path, 'wb') as encrypted_file:
-                    encrypted_file.write(encrypted_data)
-                file_size = len(encrypted_data)
+                # Encrypt straight from the upload stream to disk, one segment at a time.
+                file_size = encrypt_file(file.stream, file_path, key)
                 logging.info(f'File saved: {stored_filename} (Size: {file_size} bytes)')
             except Exception as e:
                 logging.error(f'Error saving file {stored_filename}: {e}')
@@ -214,8 +368,8 @@ def upload():
             try:
                 db = get_db()
                 cursor = db.cursor()
-                cursor.execute('INSERT INTO files (original_filename, stored_filename, user_id, file_size) VALUES (?, ?, ?, ?)',
-                               (original_filename, stored_filename, session['user_id'], file_size))
+                cursor.execute('INSERT INTO files (original_filename, stored_filename, user_id, file_size, key_id) VALUES (?, ?, ?, ?, ?)',
+                               (original_filename, stored_filename, session['user_id'], file_size, key.key_id))
                 db.commit()
                 file_id = cursor.lastrowid
             except Exception as e:
@@ -252,26 +406,16 @@ def download(file_id):
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], stored_filename)
         if os.path.exists(file_path):
             try:
-                key = load_encryption_key()
-                fernet = Fernet(key)
+                response = decrypted_file_response(file_path, original_filename, file['key_id'])
             except FileNotFoundError:
                 flash('Encryption key not found.')
                 abort(500)
-            try:
-                with open(file_path, 'rb') as encrypted_file:
-                    encrypted_data = encrypted_file.read()
-                decrypted_data = fernet.decrypt(encrypted_data)
-                logging.info(f'File downloaded: {original_filename} by user {session["username"]} (User ID: {session["user_id"]})')
-                return send_file(
-                    BytesIO(decrypted_data),
-                    as_attachment=True,
-                    download_name=original_filename,
-                    mimetype='application/octet-stream'
-                )
             except Exception as e:
                 logging.error(f'Decryption failed for file {original_filename}: {e}')
                 flash('An error occurred while decrypting the file.')
                 abort(500)
+            logging.info(f'File downloaded: {original_filename} by user {session["username"]} (User ID: {session["user_id"]})')
+            return response
         else:
             flash('File not found.')
             logging.error(f'File not found: {stored_filename}')
@@ -316,7 +460,7 @@ def share_link(shared_link):
     db = get_db()
     cursor = db.cursor()
     cursor.execute('''
-        SELECT files.original_filename, files.stored_filename 
+        SELECT files.original_filename, files.stored_filename, files.key_id
         FROM files 
         JOIN shared_links ON files.id = shared_links.file_id 
         WHERE shared_links.shared_link = ?
@@ -328,26 +472,16 @@ def share_link(shared_link):
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], stored_filename)
         if os.path.exists(file_path):
             try:
-                key = load_encryption_key()
-                fernet = Fernet(key)
+                response = decrypted_file_response(file_path, original_filename, file['key_id'])
             except FileNotFoundError:
                 flash('Encryption key not found.')
                 abort(500)
-            try:
-                with open(file_path, 'rb') as encrypted_file:
-                    encrypted_data = encrypted_file.read()
-                decrypted_data = fernet.decrypt(encrypted_data)
-                logging.info(f'File downloaded via shared link: {original_filename} (Link: {shared_link})')
-                return send_file(
-                    BytesIO(decrypted_data),
-                    as_attachment=True,
-                    download_name=original_filename,
-                    mimetype='application/octet-stream'
-                )
             except Exception as e:
                 logging.error(f'Decryption failed for shared link {shared_link}: {e}')
                 flash('An error occurred while decrypting the file.')
                 abort(500)
+            logging.info(f'File downloaded via shared link: {original_filename} (Link: {shared_link})')
+            return response
         else:
             flash('File not found.')
             logging.error(f'File not found for shared link: {shared_link}')
@@ -397,5 +531,12 @@ def internal_server_error(e):
 if __name__ == '__main__':
     init_db()
     generate_encryption_key()
+    if '--rotate-key' in sys.argv[1:]:
+        key_id = KEYS.rotate()
+        print(f'New files are now encrypted with key {key_id}; existing files are re-encrypted in the background.')
+        sys.exit(0)
     DEBUG = os.environ.get('DEBUG', 'False').lower() == 'true'
+    # With the reloader, only the child process that serves requests runs the job.
+    if REENCRYPT_INTERVAL > 0 and (not DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        start_reencryption_worker()
     app.run(debug=DEBUG)
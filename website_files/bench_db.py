@@ -0,0 +1,194 @@
+"""
+Benchmark of the file-sharing database under concurrent load (no web server needed).
+
+Usage: python bench_db.py [--rows 1000000] [--users 1000] [--readers 8] [--writers 2]
+                          [--seconds 10] [--output bench_db.json]
+
+Builds a database with --rows files spread over --users users (every tenth file shared),
+once with the original schema in rollback-journal mode ("baseline") and once migrated
+with db_schema ("tuned": indexes, WAL and the connection pragmas). Reader threads then run
+the queries behind /files and /share_link while writer threads add and delete files and
+links the way /upload, /share and /delete do, each thread on its own connection. Latency
+percentiles per query are printed and written to a JSON report.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# db_schema imports sqlite_pool.py, which is shared with todo_app and lives in ../shared.
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shared'))
+from db_schema import MIGRATIONS, add_indexes, check_query_plans, connect, migrate
+
+FILES_QUERY = 'SELECT * FROM files WHERE user_id = ?'
+SHARE_LINK_QUERY = '''
+    SELECT files.original_filename, files.stored_filename, files.key_id
+    FROM files
+    JOIN shared_links ON files.id = shared_links.file_id
+    WHERE shared_links.shared_link = ?
+'''
+
+def open_connection(path, tuned):
+    if tuned:
+        return connect(path)
+    db = sqlite3.connect(path, timeout=5)
+    db.row_factory = sqlite3.Row
+    return db
+
+def build_database(path, rows, users, tuned):
+    """Create and fill a database. Returns the shared links, for the readers to look up."""
+    db = sqlite3.connect(path)
+    if tuned:
+        migrate(db)
+    else:
+        # Everything but the indexes, in the default journal mode.
+        migrate(db, target=MIGRATIONS.index(add_indexes))
+        db.execute('PRAGMA journal_mode = DELETE')
+    db.executemany(
+        'INSERT INTO users (id, username, password) VALUES (?, ?, ?)',
+        ((user_id, f'user{user_id}', 'x') for user_id in range(1, users + 1))
+    )
+    db.executemany(
+        'INSERT INTO files (id, original_filename, stored_filename, user_id, file_size) VALUES (?, ?, ?, ?, ?)',
+        ((file_id, f'file{file_id}.txt', f'{file_id:032x}_file{file_id}.txt', random.randint(1, users), 1024)
+         for file_id in range(1, rows + 1))
+    )
+    links = [os.urandom(16).hex() for _ in range(0, rows, 10)]
+    db.executemany(
+        'INSERT INTO shared_links (file_id, shared_link) VALUES (?, ?)',
+        ((index * 10 + 1, link) for index, link in enumerate(links))
+    )
+    db.commit()
+    if tuned:
+        db.execute('ANALYZE')
+    db.close()
+    return links
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    pick = lambda fraction: samples[min(len(samples) - 1, int(fraction * len(samples)))]
+    return {
+        'count': len(samples),
+        'p50_ms': round(pick(0.50) * 1000, 3),
+        'p95_ms': round(pick(0.95) * 1000, 3),
+        'p99_ms': round(pick(0.99) * 1000, 3),
+        'max_ms': round(samples[-1] * 1000, 3),
+    }
+
+def run_load(path, links, users, readers, writers, seconds, tuned):
+    """Run readers and writers against the database for seconds. Returns latency samples per operation."""
+    samples = {'/files': [], '/share_link': [], 'write': []}
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def timed(db, name, fn):
+        start = time.perf_counter()
+        try:
+            fn(db)
+        except sqlite3.OperationalError as e:
+            with lock:
+                errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            samples[name].append(elapsed)
+
+    def reader():
+        db = open_connection(path, tuned)
+        while time.perf_counter() < deadline:
+            user_id = random.randint(1, users)
+            timed(db, '/files', lambda db: db.execute(FILES_QUERY, (user_id,)).fetchall())
+            link = random.choice(links)
+            timed(db, '/share_link', lambda db: db.execute(SHARE_LINK_QUERY, (link,)).fetchone())
+        db.close()
+
+    def write(db):
+        user_id = random.randint(1, users)
+        cursor = db.cursor()
+        cursor.execute(
+            'INSERT INTO files (original_filename, stored_filename, user_id, file_size) VALUES (?, ?, ?, ?)',
+            ('new.txt', f'{os.urandom(16).hex()}_new.txt', user_id, 1024)
+        )
+        file_id = cursor.lastrowid
+        cursor.execute('SELECT shared_link FROM shared_links WHERE file_id = ?', (file_id,)).fetchone()
+        cursor.execute('INSERT INTO shared_links (file_id, shared_link) VALUES (?, ?)', (file_id, os.urandom(16).hex()))
+        cursor.execute('DELETE FROM shared_links WHERE file_id = ?', (file_id,))
+        cursor.execute('DELETE FROM files WHERE id = ?', (file_id,))
+        db.commit()
+
+    def writer():
+        db = open_connection(path, tuned)
+        while time.perf_counter() < deadline:
+            timed(db, 'write', write)
+        db.close()
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the file-sharing database under concurrent load.')
+    parser.add_argument('--rows', type=int, default=1000000, help='number of file rows')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--readers', type=int, default=8, help='reader threads')
+    parser.add_argument('--writers', type=int, default=2, help='writer threads')
+    parser.add_argument('--seconds', type=float, default=10, help='duration of each load run')
+    parser.add_argument('--output', default='bench_db.json', help='path of the JSON report')
+    args = parser.parse_args(argv)
+    # check_query_plans logs a warning per full scan; the count printed below is enough.
+    logging.basicConfig(level=logging.ERROR)
+
+    workdir = tempfile.mkdtemp(prefix='bench_db_')
+    results = []
+    try:
+        for tuned in (False, True):
+            mode = 'tuned' if tuned else 'baseline'
+            path = os.path.join(workdir, f'{mode}.db')
+            start = time.perf_counter()
+            links = build_database(path, args.rows, args.users, tuned)
+            print(f'{mode}: built {args.rows} rows in {time.perf_counter() - start:.1f} s')
+            db = sqlite3.connect(path)
+            print(f'{mode}: {len(check_query_plans(db))} queries scan whole tables')
+            db.close()
+            samples, errors = run_load(path, links, args.users, args.readers, args.writers, args.seconds, tuned)
+            for operation, values in samples.items():
+                stats = percentiles(values)
+                results.append({'mode': mode, 'operation': operation, **stats})
+                if stats:
+                    print(f"{mode:<9} {operation:<12} {stats['count']:>8} ops  p50 {stats['p50_ms']:>9.3f} ms"
+                          f"  p95 {stats['p95_ms']:>9.3f} ms  p99 {stats['p99_ms']:>9.3f} ms")
+            if errors:
+                print(f'{mode}: {len(errors)} operations failed (e.g. {errors[0]})')
+            results.append({'mode': mode, 'operation': 'errors', 'count': len(errors)})
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'settings': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f'Report written to {args.output}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import logging
+import sqlite3
+
+# The per-connection settings live with the connection pool, which todo_app shares.
+from sqlite_pool import PRAGMAS
+
+def create_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            original_filename TEXT NOT NULL,
+            stored_filename TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            file_size INTEGER,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shared_links (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_id INTEGER NOT NULL,
+            shared_link TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(file_id) REFERENCES files(id)
+        )
+    ''')
+
+def add_key_id(cursor):
+    # Files stored before key rotation existed were all encrypted with key 1. Databases
+    # created by the first version of key rotation already have the column.
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(files)')]
+    if 'key_id' not in columns:
+        cursor.execute('ALTER TABLE files ADD COLUMN key_id INTEGER NOT NULL DEFAULT 1')
+
+def add_indexes(cursor):
+    # /files lists a user's files; /share and /delete look up a file's links;
+    # the re-encryption job looks for files encrypted with an older key.
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_user_id ON files(user_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_shared_links_file_id ON shared_links(file_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_key_id ON files(key_id)')
+    cursor.execute('ANALYZE')
+
+def add_retired_files(cursor):
+    # Files the re-encryption job has replaced but not yet deleted. Keeping them in the database
+    # means a restart can't leave ciphertext under an old key behind on disk.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS retired_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            stored_filename TEXT NOT NULL,
+            retired_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+# Schema migrations, in order. The database's PRAGMA user_version is the number of migrations
+# already applied; each one runs in its own transaction together with the version bump.
+# Only ever append to this list.
+MIGRATIONS = [
+    create_tables,
+    add_key_id,
+    add_indexes,
+    add_retired_files,
+]
+
+# The queries the app runs on every page view, with sample parameters, and the tables each
+# must reach through an index rather than a full scan.
+QUERY_PLAN_CHECKS = {
+    '/files': ('SELECT * FROM files WHERE user_id = ?', (1,)),
+    '/download, /share, /delete': ('SELECT * FROM files WHERE id = ? AND user_id = ?', (1, 1)),
+    '/share': ('SELECT shared_link FROM shared_links WHERE file_id = ?', (1,)),
+    '/delete': ('DELETE FROM shared_links WHERE file_id = ?', (1,)),
+    '/share_link': ('''
+        SELECT files.original_filename, files.stored_filename, files.key_id
+        FROM files
+        JOIN shared_links ON files.id = shared_links.file_id
+        WHERE shared_links.shared_link = ?
+    ''', ('',)),
+    're-encryption': ('SELECT id, original_filename, stored_filename, key_id FROM files WHERE key_id < ? LIMIT ?', (1, 1)),
+}
+
+def configure_connection(db):
+    """Apply PRAGMAS to a new connection."""
+    for name, value in PRAGMAS:
+        db.execute(f'PRAGMA {name} = {value}')
+    return db
+
+def connect(database):
+    """Open a configured connection that returns sqlite3.Row rows."""
+    db = sqlite3.connect(database)
+    db.row_factory = sqlite3.Row
+    return configure_connection(db)
+
+def schema_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(db, target=None):
+    """
+    Switch the database to WAL mode and apply the migrations it hasn't had yet, up to target
+    (all by default). Returns the number of migrations applied.
+    """
+    # The journal mode is stored in the database file, so this only has to happen once,
+    # and it can't be changed inside a transaction.
+    db.execute('PRAGMA journal_mode = WAL')
+    target = len(MIGRATIONS) if target is None else target
+    applied = 0
+    version = schema_version(db)
+    while version < target:
+        migration = MIGRATIONS[version]
+        cursor = db.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            migration(cursor)
+            version += 1
+            cursor.execute(f'PRAGMA user_version = {version}')
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+        logging.info(f'Database migrated to version {version} ({migration.__name__}).')
+        applied += 1
+    return applied
+
+def check_query_plans(db):
+    """
+    Run EXPLAIN QUERY PLAN on QUERY_PLAN_CHECKS and return a warning for every query that
+    scans a whole table, e.g. because a migration that adds an index wasn't applied.
+    """
+    warnings = []
+    for name, (query, params) in QUERY_PLAN_CHECKS.items():
+        for row in db.execute(f'EXPLAIN QUERY PLAN {query}', params):
+            detail = row[3]
+            # "SCAN files" reads every row; "SEARCH files USING INDEX ..." doesn't.
+            if detail.startswith('SCAN '):
+                warnings.append(f'{name}: {" ".join(query.split())} -> {detail}')
+    for warning in warnings:
+        logging.warning(f'Query plan does not use an index: {warning}')
+    return warnings
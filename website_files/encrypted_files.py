@@ -0,0 +1,186 @@
+import os
+import struct
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# Streaming file format ("EGCM"):
+#   header:   magic (4 bytes) | format version (1) | segment size (4, big-endian) | nonce prefix (7)
+#   segments: AES-256-GCM ciphertext of each plaintext segment followed by its 16-byte tag
+# Every segment but the last holds exactly segment size bytes of plaintext, so the position of
+# any byte can be computed without reading the file. Each segment's nonce is the nonce prefix,
+# the segment number (4 bytes) and a last-segment flag (1 byte), and the header is authenticated
+# with every segment, so segments can't be reordered, dropped, truncated or swapped between files.
+MAGIC = b'EGCM'
+FORMAT_VERSION = 1
+SEGMENT_SIZE = 64 * 1024
+TAG_SIZE = 16
+NONCE_PREFIX_SIZE = 7
+HEADER = struct.Struct('!4sBI7s')
+MAX_SEGMENTS = 2 ** 32
+
+class DecryptionError(Exception):
+    pass
+
+def derive_key(fernet_key):
+    """Derive the AES-256-GCM key from the app's Fernet key, so one key file serves both formats."""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'website_files streaming encryption v1',
+    ).derive(fernet_key)
+
+class FileKey:
+    """
+    One encryption key with its cipher objects built once: the Fernet key as stored on disk,
+    a Fernet instance for legacy files and the derived AES-GCM instance for the streaming format.
+    """
+
+    def __init__(self, key_id, fernet_key):
+        self.key_id = key_id
+        self.fernet_key = fernet_key
+        self.fernet = Fernet(fernet_key)
+        self.aesgcm = AESGCM(derive_key(fernet_key))
+
+def segment_nonce(nonce_prefix, index, last):
+    return nonce_prefix + struct.pack('!IB', index, 1 if last else 0)
+
+def read_full(stream, size):
+    """Read up to size bytes, looping over short reads; fewer bytes means end of stream."""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+def encrypt_stream(source, destination, key, segment_size=SEGMENT_SIZE):
+    """
+    Encrypt everything readable from the file-like source into the file-like destination
+    with a FileKey, one segment at a time, so memory use doesn't depend on the file size.
+    Returns the number of bytes written.
+    """
+    aesgcm = key.aesgcm
+    nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, segment_size, nonce_prefix)
+    destination.write(header)
+    written = len(header)
+    index = 0
+    segment = read_full(source, segment_size)
+    while True:
+        # Read one segment ahead to know whether the current one is the last.
+        next_segment = read_full(source, segment_size) if len(segment) == segment_size else b''
+        last = not next_segment
+        if index >= MAX_SEGMENTS:
+            raise ValueError('File is too large to encrypt.')
+        sealed = aesgcm.encrypt(segment_nonce(nonce_prefix, index, last), segment, header)
+        destination.write(sealed)
+        written += len(sealed)
+        if last:
+            return written
+        segment = next_segment
+        index += 1
+
+def encrypt_file(source, path, key):
+    """
+    Encrypt a file-like source to path with a FileKey. The file is written under a temporary name and
+    renamed when complete, so a failed upload never leaves a partial file behind.
+    Returns the size of the encrypted file.
+    """
+    tmp_path = path + '.part'
+    try:
+        with open(tmp_path, 'wb') as destination:
+            size = encrypt_stream(source, destination, key)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return size
+
+class EncryptedFile:
+    """
+    Read access to a stored file in either format, given the FileKey it was encrypted with:
+    the streaming format above, decrypted one segment at a time, or a legacy whole-file Fernet
+    token, which has to be decrypted in one go.
+    """
+
+    def __init__(self, path, key, chunk_size=SEGMENT_SIZE):
+        self.path = path
+        self.key = key
+        self.chunk_size = chunk_size
+        self.stored_size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        self.legacy = not header.startswith(MAGIC)
+        if self.legacy:
+            self.header = None
+            self._legacy_data = None
+            return
+        if len(header) < HEADER.size:
+            raise DecryptionError('Encrypted file header is truncated.')
+        magic, version, self.segment_size, self.nonce_prefix = HEADER.unpack(header)
+        if version != FORMAT_VERSION:
+            raise DecryptionError(f'Unsupported encrypted file version {version}.')
+        self.header = header
+        self.aesgcm = key.aesgcm
+        body = self.stored_size - HEADER.size
+        stored_segment = self.segment_size + TAG_SIZE
+        # Every file has at least one (possibly empty) segment.
+        self.segments = max(1, -(-body // stored_segment))
+        self.size = body - self.segments * TAG_SIZE
+        if self.size < 0:
+            raise DecryptionError('Encrypted file is truncated.')
+
+    def _legacy_plaintext(self):
+        if self._legacy_data is None:
+            with open(self.path, 'rb') as f:
+                self._legacy_data = self.key.fernet.decrypt(f.read())
+        return self._legacy_data
+
+    def plaintext_size(self):
+        """The size of the decrypted file (for legacy files this decrypts the whole file)."""
+        if self.legacy:
+            return len(self._legacy_plaintext())
+        return self.size
+
+    def decrypt_segment(self, f, index):
+        """Read and decrypt segment index from the open file f."""
+        stored_segment = self.segment_size + TAG_SIZE
+        f.seek(HEADER.size + index * stored_segment)
+        sealed = f.read(stored_segment)
+        last = index == self.segments - 1
+        try:
+            return self.aesgcm.decrypt(segment_nonce(self.nonce_prefix, index, last), sealed, self.header)
+        except Exception as e:
+            raise DecryptionError(f'Segment {index} failed authentication.') from e
+
+    def iter_chunks(self):
+        """Yield the decrypted file in chunks of at most one segment (chunk_size for legacy files)."""
+        return self.iter_range(0, self.plaintext_size())
+
+    def iter_range(self, start, stop):
+        """
+        Yield the decrypted bytes start to stop (exclusive) in chunks. Only the segments that
+        overlap the range are read and decrypted; legacy files are decrypted whole and sliced.
+        """
+        if start >= stop:
+            return
+        if self.legacy:
+            data = self._legacy_plaintext()
+            for offset in range(start, stop, self.chunk_size):
+                yield data[offset:min(offset + self.chunk_size, stop)]
+            return
+        first = start // self.segment_size
+        last = (stop - 1) // self.segment_size
+        with open(self.path, 'rb') as f:
+            for index in range(first, last + 1):
+                plaintext = self.decrypt_segment(f, index)
+                segment_start = index * self.segment_size
+                yield plaintext[max(start - segment_start, 0):stop - segment_start]
@@ -0,0 +1,84 @@
+import logging
+import os
+import re
+import threading
+import time
+
+from cryptography.fernet import Fernet
+
+from encrypted_files import FileKey
+
+class KeyManager:
+    """
+    Process-wide set of encryption keys, loaded from disk once and kept with their cipher
+    objects (see encrypted_files.FileKey), instead of re-reading the key file per request.
+
+    Key 1 is the original key file (e.g. secret.key); rotate() adds secret.key.2,
+    secret.key.3, ... The highest key id is the current one, used for new uploads; older
+    keys stay loaded so files encrypted with them can still be read until they have been
+    re-encrypted (see reencrypt_batch in app.py). current() looks for keys added on disk (e.g.
+    by a rotation in another process) at most every check_interval seconds. Safe to use from
+    several threads.
+    """
+
+    def __init__(self, key_file, check_interval=1.0):
+        self.key_file = key_file
+        self.check_interval = check_interval
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._checked_at = None  # time.monotonic() of the last check for new key files
+
+    def key_path(self, key_id):
+        return self.key_file if key_id == 1 else f'{self.key_file}.{key_id}'
+
+    def _key_ids_on_disk(self):
+        directory = os.path.dirname(self.key_file) or '.'
+        pattern = re.compile(re.escape(os.path.basename(self.key_file)) + r'\.(\d+)$')
+        key_ids = [1] if os.path.exists(self.key_file) else []
+        for filename in os.listdir(directory):
+            match = pattern.match(filename)
+            if match:
+                key_ids.append(int(match.group(1)))
+        return sorted(key_ids)
+
+    def reload(self):
+        """Load keys added on disk since the last load (e.g. by a rotation in another process)."""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            for key_id in self._key_ids_on_disk():
+                if key_id not in self._keys:
+                    with open(self.key_path(key_id), 'rb') as key_file:
+                        self._keys[key_id] = FileKey(key_id, key_file.read().strip())
+                    logging.info(f'Encryption key {key_id} loaded.')
+            if not self._keys:
+                logging.error('Encryption key file not found.')
+                raise FileNotFoundError('Encryption key file not found.')
+
+    def get(self, key_id):
+        """Return the FileKey with this id, loading new keys from disk if it isn't known yet."""
+        key = self._keys.get(key_id)
+        if key is None:
+            self.reload()
+            key = self._keys.get(key_id)
+            if key is None:
+                raise FileNotFoundError(f'Encryption key {key_id} not found.')
+        return key
+
+    def current(self):
+        """Return the FileKey new files are encrypted with (the one with the highest id)."""
+        if not self._keys or time.monotonic() - self._checked_at >= self.check_interval:
+            self.reload()
+        return self._keys[max(self._keys)]
+
+    def rotate(self):
+        """Generate a new key, which becomes the current one. Returns its id."""
+        self.reload()
+        with self._lock:
+            key_id = max(self._keys) + 1
+            path = self.key_path(key_id)
+            with open(path + '.tmp', 'wb') as key_file:
+                key_file.write(Fernet.generate_key())
+            os.replace(path + '.tmp', path)
+        self.reload()
+        logging.info(f'Encryption key rotated; new files are encrypted with key {key_id}.')
+        return key_id
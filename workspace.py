@@ -0,0 +1,106 @@
+import fnmatch
+import hashlib
+import os
+
+# Directories that are never included in a snapshot.
+# ".staging" holds files that atomic_writes.FileTransaction has not moved into place yet.
+IGNORED_DIRS = {"__pycache__", ".git", ".venv", "venv", "node_modules", ".pytest_cache", ".staging"}
+# File name patterns that are never included in a snapshot: databases, logs, compiled files and binaries.
+IGNORED_PATTERNS = (
+    "*.db", "*.sqlite", "*.sqlite3", "*.log", "*.pyc", "*.pyo", "*.so", "*.dll", "*.exe",
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.ico", "*.pdf", "*.zip", "*.gz", "*.key",
+)
+# How many leading bytes are checked for NUL bytes to detect binary files.
+BINARY_SNIFF_BYTES = 8192
+
+def is_ignored(filename):
+    """Return True if the file name matches one of the IGNORED_PATTERNS."""
+    return any(fnmatch.fnmatch(filename, pattern) for pattern in IGNORED_PATTERNS)
+
+class WorkspaceSnapshot:
+    """
+    Incremental snapshot of the text files in a directory, for building prompts.
+
+    An index maps each relative path to (mtime, size, sha256, content). refresh() only
+    re-reads files whose mtime or size changed since the last refresh, so repeated
+    snapshots of a large, mostly unchanged tree cost one stat() per file.
+    Ignored directories, ignored file patterns, binary files and files that are not
+    valid UTF-8 are skipped instead of crashing the run.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = {}
+
+    def refresh(self):
+        """
+        Bring the index up to date with the directory.
+        Returns the list of relative paths that were added or changed since the last refresh.
+        """
+        changed = []
+        seen = set()
+        for root, dirs, files in os.walk(self.directory):
+            dirs[:] = sorted(d for d in dirs if d not in IGNORED_DIRS)
+            for filename in sorted(files):
+                if is_ignored(filename):
+                    continue
+                file_path = os.path.join(root, filename)
+                relative_path = os.path.relpath(file_path, self.directory)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                seen.add(relative_path)
+                cached = self.index.get(relative_path)
+                if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+                    continue
+                content = self._read_text(file_path)
+                if content is None:
+                    self.index.pop(relative_path, None)
+                    continue
+                digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+                if cached is None or cached[2] != digest:
+                    changed.append(relative_path)
+                self.index[relative_path] = (stat.st_mtime_ns, stat.st_size, digest, content)
+        for relative_path in list(self.index):
+            if relative_path not in seen:
+                del self.index[relative_path]
+        return changed
+
+    def files(self):
+        """Return a dictionary mapping relative paths to their (stripped) content."""
+        return {path: entry[3] for path, entry in sorted(self.index.items())}
+
+    def render(self, paths=None):
+        """
+        Render the snapshot (or only the given paths) in the custom file format:
+        ### filename: <path> ###, the content, then ### end ###.
+        """
+        if paths is None:
+            paths = sorted(self.index)
+        return "".join(
+            f"### filename: {path} ###\n{self.index[path][3]}\n### end ###\n"
+            for path in paths if path in self.index
+        )
+
+    @staticmethod
+    def _read_text(file_path):
+        with open(file_path, "rb") as f:
+            data = f.read()
+        if b"\0" in data[:BINARY_SNIFF_BYTES]:
+            return None
+        try:
+            return data.decode("utf-8").strip()
+        except UnicodeDecodeError:
+            return None
+
+_snapshots = {}
+
+def get_snapshot(directory):
+    """Return the shared, refreshed WorkspaceSnapshot for a directory."""
+    key = os.path.abspath(directory)
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+        snapshot = _snapshots[key] = WorkspaceSnapshot(directory)
+    snapshot.refresh()
+    return snapshot